@@ -1,10 +1,18 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
+from typing import Optional
+
 from pydantic import BaseModel
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 
-from services.database import recommend_jobs_for_cv, recommend_cvs_for_job
-from services.gemini_analysis import FilterRequest, filter_candidates, related_jobs, analyze_cv_with_jobs
+from services.database import recommend_jobs_for_cv, recommend_jobs_for_cvs, recommend_cvs_for_job, pool_stats
+from services.cache import CacheLockTimeout, cache_stats
+from services.llm_client import scheduler_stats
+from services.job_index import job_index
+from services.job_neighbors import job_neighbors
+from services.gemini_analysis import FilterRequest, filter_candidates, related_jobs, analyze_cv_with_jobs, llm_cache
+from services.analysis_queue import analysis_queue, DONE, FAILED
+from services.streaming import MEDIA_TYPES, stream_events
     # generate_resume_text, html_to_image_base64
 
 
@@ -18,39 +26,136 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(CacheLockTimeout)
+async def cache_lock_timeout(request, exc: CacheLockTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+@app.on_event("startup")
+def on_startup():
+    # Schema migrations are a deploy step (python -m services.migrations), not run by every worker.
+    # Only the saved files are read here; re-embedding runs off the serving path
+    job_index.load()
+    job_neighbors.load()
+    job_neighbors.sync_in_background()
+
+
 @app.get("/api/recommend/jobs-for-cv/{cv_id}")
 def get_job_recommendations(cv_id: int):
     result = recommend_jobs_for_cv(cv_id)
     return {"cv_id": cv_id, "recommended_jobs": result}
 
+class CVIdsBody(BaseModel):
+    cv_ids: list[int]
+
+@app.post("/api/recommend/jobs-for-cvs")
+def get_batch_job_recommendations(req: CVIdsBody):
+    results = recommend_jobs_for_cvs(req.cv_ids)
+    return {"recommendations": [{"cv_id": cv_id, "recommended_jobs": jobs} for cv_id, jobs in results.items()]}
+
 @app.get("/api/recommend/cvs-for-job/{job_id}")
 def get_job_recommendations(job_id: int):
     result = recommend_cvs_for_job(job_id)
     return {"job_id": job_id, "recommended_cvs": result}
 
 @app.post("/api/filter")
-def get_filter_cvs(req: FilterRequest):
-    return filter_candidates(req)
+async def get_filter_cvs(req: FilterRequest):
+    return await filter_candidates(req)
+
+@app.post("/api/job-index/refresh")
+def refresh_job_index():
+    neighbors = job_neighbors.sync()
+    return {"index": job_index.stats(), "neighbors": neighbors}
+
+@app.post("/api/job-index/rebuild-neighbors")
+def rebuild_job_neighbors():
+    return {"index": job_index.stats(), "neighbors": job_neighbors.build()}
 
 @app.get("/api/related-jobs/{job_id}")
-def get_related_jobs(job_id: int):
-    return related_jobs(job_id)
+async def get_related_jobs(job_id: int, rerank: bool = False, stale_while_revalidate: Optional[bool] = None):
+    return await related_jobs(job_id, rerank, stale_while_revalidate)
+
+@app.get("/api/related-jobs/{job_id}/stream")
+async def stream_related_jobs(job_id: int, rerank: bool = True, format: str = Query("sse", pattern="^(sse|ndjson)$")):
+    """
+    Related jobs as Server-Sent Events or NDJSON: one "match" per re-scored job, then a sorted "summary"
+    """
+    events = stream_events(
+        lambda on_event: related_jobs(job_id, rerank, on_event=on_event),
+        lambda results: {"job_id": job_id, "results": results},
+        format
+    )
+    return StreamingResponse(events, media_type=MEDIA_TYPES[format])
 
 class CVBody(BaseModel):
     cv_text: str
     cv_id: int
+    top_k: Optional[int] = None
+    min_similarity: Optional[float] = None
+    stale_while_revalidate: Optional[bool] = None
+    batch_size: Optional[int] = None
 
 @app.post("/api/analyze/cv")
-def analyze_cv(req: CVBody):
+async def analyze_cv(req: CVBody, wait: bool = False):
+    """
+    Enqueue an analysis and return its task id; ``wait=true`` runs it inline instead
+    """
+    if not wait:
+        task = await analysis_queue.enqueue(req.model_dump(exclude={"stale_while_revalidate"}))
+        return JSONResponse(status_code=202, content=task)
+
     try:
-        results = analyze_cv_with_jobs(req.cv_text, req.cv_id)
+        results = await analyze_cv_with_jobs(
+            req.cv_text, req.cv_id, req.top_k, req.min_similarity, req.stale_while_revalidate, req.batch_size
+        )
         return results
+    except CacheLockTimeout:
+        raise
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"detail": f"Error during analysis: {str(e)}"}
         )
 
+@app.post("/api/analyze/cv/stream")
+async def stream_analyze_cv(req: CVBody, format: str = Query("sse", pattern="^(sse|ndjson)$")):
+    """
+    CV analysis as Server-Sent Events or NDJSON: "plan", then "match"/"progress" as pairs complete,
+    then the full analysis with sorted matches as "summary"
+    """
+    events = stream_events(
+        lambda on_event: analyze_cv_with_jobs(
+            req.cv_text, req.cv_id, req.top_k, req.min_similarity, False, req.batch_size, on_event
+        ),
+        lambda analysis: analysis,
+        format
+    )
+    return StreamingResponse(events, media_type=MEDIA_TYPES[format])
+
+async def _get_task(task_id: str):
+    task = await analysis_queue.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Analysis task not found")
+    return task
+
+@app.get("/api/analyze/tasks/{task_id}")
+async def get_analysis_task(task_id: str):
+    return await _get_task(task_id)
+
+@app.get("/api/analyze/tasks/{task_id}/partial")
+async def get_analysis_task_partial(task_id: str):
+    task = await _get_task(task_id)
+    matches = await analysis_queue.partial(task_id)
+    return {**task, "matches": sorted(matches, key=lambda x: x["match_score"], reverse=True)}
+
+@app.get("/api/analyze/tasks/{task_id}/result")
+async def get_analysis_task_result(task_id: str):
+    task = await _get_task(task_id)
+    if task["status"] == FAILED:
+        return JSONResponse(status_code=500, content={"detail": f"Error during analysis: {task['error']}"})
+    if task["status"] != DONE:
+        return JSONResponse(status_code=202, content=task)
+    return await analysis_queue.result(task_id)
+
 
 class ResumeRequest(BaseModel):
     cv_data: dict
@@ -68,19 +173,7 @@ class ResumeRequest(BaseModel):
 #         raise HTTPException(status_code=500, detail=str(e))
 
 
-import redis
-import os
-
-from dotenv import load_dotenv
-
-load_dotenv()
-
-
-redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=int(os.getenv("REDIS_PORT")),
-    db=int(os.getenv("REDIS_DB"))
-)
+from services.redis_pool import async_redis_client
 
 
 @app.get("/api/cache/check-exists")
@@ -89,7 +182,7 @@ async def check_cache_exists(key: str):
     Check if a cache key exists in Redis
     """
     try:
-        exists = redis_client.exists(key)
+        exists = await async_redis_client.exists(key)
         return exists == 1
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to check cache: {str(e)}")
@@ -101,7 +194,7 @@ async def delete_cache(key: str):
     Delete a cache key from Redis
     """
     try:
-        deleted = redis_client.delete(key)
+        deleted = await async_redis_client.delete(key)
         if deleted == 0:
             return {"success": False, "message": "Key not found"}
         return {"success": True, "message": "Cache deleted successfully"}
@@ -109,14 +202,48 @@ async def delete_cache(key: str):
         raise HTTPException(status_code=500, detail=f"Failed to delete cache: {str(e)}")
 
 
+MAX_SCAN_CALLS_PER_PAGE = 50
+
+
 @app.get("/api/cache/list-keys")
-async def list_cache_keys(pattern: str = "*"):
+async def list_cache_keys(
+    pattern: str = "*",
+    cursor: int = 0,
+    count: int = Query(100, ge=1, le=10000),
+    limit: int = Query(100, ge=1, le=10000),
+    with_meta: bool = False
+):
     """
-    List all cache keys matching a pattern
+    List one page of cache keys matching a pattern, using non-blocking SCAN.
+
+    Pass the returned ``cursor`` back to fetch the next page; ``complete`` is true
+    once the whole keyspace has been walked. ``count`` is the SCAN batch hint and
+    ``limit`` a soft cap on keys per page. ``with_meta`` adds TTL and memory usage
+    per key, fetched in a single pipeline round trip.
     """
     try:
-        keys = redis_client.keys(pattern)
-        return {"keys": keys}
+        keys = []
+        calls = 0
+        while True:
+            cursor, batch = await async_redis_client.scan(cursor=cursor, match=pattern, count=count)
+            keys.extend(key.decode() for key in batch)
+            calls += 1
+            # Bound the work per request even when the pattern matches sparsely
+            if cursor == 0 or len(keys) >= limit or calls >= MAX_SCAN_CALLS_PER_PAGE:
+                break
+
+        page = {"keys": keys, "cursor": cursor, "complete": cursor == 0}
+        if with_meta and keys:
+            async with async_redis_client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.ttl(key)
+                    pipe.memory_usage(key)
+                meta = await pipe.execute()
+            page["keys"] = [
+                {"key": key, "ttl": meta[2 * i], "memory_bytes": meta[2 * i + 1]}
+                for i, key in enumerate(keys)
+            ]
+        return page
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to list cache keys: {str(e)}")
 
@@ -127,7 +254,7 @@ async def get_cache_ttl(key: str):
     Get the TTL (time to live) for a cache key
     """
     try:
-        ttl = redis_client.ttl(key)
+        ttl = await async_redis_client.ttl(key)
         if ttl == -2:
             return {"ttl": None, "exists": False, "message": "Key does not exist"}
         elif ttl == -1:
@@ -135,3 +262,36 @@ async def get_cache_ttl(key: str):
         return {"ttl": ttl, "exists": True, "message": f"Key expires in {ttl} seconds"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get TTL: {str(e)}")
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """
+    Hit ratio per cache key family (per worker process)
+    """
+    return cache_stats()
+
+
+@app.get("/api/cache/llm-stats")
+async def get_llm_cache_stats():
+    """
+    Hit and miss counters of the Gemini response cache (per worker process)
+    """
+    return llm_cache.stats()
+
+
+@app.get("/api/llm/scheduler-stats")
+async def get_llm_scheduler_stats():
+    """
+    Gemini rate-limit bucket levels (shared across workers with the Redis backend) and
+    retry/failure totals (per worker process)
+    """
+    return await scheduler_stats()
+
+
+@app.get("/api/db/pool-stats")
+async def get_db_pool_stats():
+    """
+    PostgreSQL connection pool metrics (per worker process)
+    """
+    return pool_stats()
@@ -0,0 +1,96 @@
+"""
+Size and encode/decode time of cached payloads: plain json.dumps vs the compact serializer.
+
+Uses synthetic nli_analysis / related_jobs payloads shaped like the real ones, so
+no Redis or database is needed:
+
+    python -m scripts.bench_cache_serializer --matches 50 --iterations 2000
+"""
+import time
+import random
+import argparse
+from datetime import datetime
+
+from services.serialization import JsonSerializer, CompactSerializer
+
+WORDS = (
+    "candidate experience python backend services postgres redis api design team "
+    "requirements skills strong relevant years project delivery cloud docker "
+    "lacks limited exposure matches closely aligned role responsibilities"
+).split()
+
+
+def explanation(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def nli_analysis_payload(rng: random.Random, matches: int, words: int):
+    return {
+        "cv_id": 42,
+        "total_jobs": 2000,
+        "analyzed_jobs": matches,
+        "pruned_jobs": 2000 - matches,
+        "scored_pairs": matches,
+        "reused_pairs": 0,
+        "matches": [
+            {
+                "job_id": rng.randint(1, 100_000),
+                "match_score": round(rng.random(), 3),
+                "similarity": round(rng.random(), 4),
+                "explanation": explanation(rng, words),
+                "created_at": datetime.now().isoformat()
+            }
+            for _ in range(matches)
+        ]
+    }
+
+
+def related_jobs_payload(rng: random.Random, matches: int, words: int):
+    return [
+        {"jobId": rng.randint(1, 100_000), "score": round(rng.random(), 3), "explanation": explanation(rng, words)}
+        for _ in range(matches)
+    ]
+
+
+def measure(serializer, payload, iterations: int):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        raw = serializer.dumps(payload)
+    encode = (time.perf_counter() - started) / iterations
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        serializer.loads(raw)
+    decode = (time.perf_counter() - started) / iterations
+    return len(raw), encode, decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--matches", type=int, default=50, help="entries per payload")
+    parser.add_argument("--words", type=int, default=60, help="words per Gemini explanation")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--min-bytes", type=int, default=1024, help="compression threshold")
+    parser.add_argument("--level", type=int, default=3, help="zstd level")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    payloads = {
+        "nli_analysis": nli_analysis_payload(rng, args.matches, args.words),
+        "related_jobs (rerank top 5)": related_jobs_payload(rng, 5, args.words),
+        "related_jobs": related_jobs_payload(rng, args.matches, args.words),
+    }
+    serializers = [JsonSerializer(), CompactSerializer(min_bytes=args.min_bytes, level=args.level)]
+
+    print(f"{'payload':28} {'format':8} {'bytes':>9} {'ratio':>6} {'encode us':>10} {'decode us':>10}")
+    for name, payload in payloads.items():
+        baseline = None
+        for serializer in serializers:
+            size, encode, decode = measure(serializer, payload, args.iterations)
+            baseline = baseline or size
+            print(f"{name:28} {serializer.name:8} {size:9d} {size / baseline:6.2f} "
+                  f"{encode * 1e6:10.1f} {decode * 1e6:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
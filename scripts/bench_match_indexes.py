@@ -0,0 +1,103 @@
+"""
+Query plans for the cv_job_matches hot queries before and after the composite indexes.
+
+Builds a synthetic table in a throwaway schema, so it is safe to run against a
+development database:
+
+    python -m scripts.bench_match_indexes --rows 1000000
+"""
+import time
+import argparse
+
+from services.database import connect
+from services.migrations import MIGRATIONS, MATCH_INDEX_STATEMENTS
+
+BENCH_SCHEMA = "bench_match_indexes"
+
+# name -> (filter column, query)
+HOT_QUERIES = {
+    "recommend_jobs_for_cv": ("cv_id", """
+        SELECT job_id, match_score, explanation
+        FROM cv_job_matches
+        WHERE cv_id = %s
+        ORDER BY match_score DESC
+        LIMIT 10
+    """),
+    "recommend_cvs_for_job": ("job_id", """
+        SELECT cv_id, match_score, explanation
+        FROM cv_job_matches
+        WHERE job_id = %s
+        ORDER BY match_score DESC
+        LIMIT 10
+    """),
+}
+
+
+def explain(cur, name: str, sample_id: int):
+    column, query = HOT_QUERIES[name]
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, (sample_id,))
+    plan = "\n".join(row[0] for row in cur.fetchall())
+    print(f"--- {name} ({column} = {sample_id}) ---")
+    print(plan)
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--cvs", type=int, default=50_000)
+    parser.add_argument("--jobs", type=int, default=2_000)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark schema afterwards")
+    args = parser.parse_args()
+
+    conn = connect()
+    conn.autocommit = True  # CREATE INDEX CONCURRENTLY refuses to run in a transaction
+    cur = conn.cursor()
+
+    try:
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+        cur.execute(f"SET search_path TO {BENCH_SCHEMA}")
+        cur.execute(MIGRATIONS[0].statements[0])  # cv_job_matches as the migrations create it
+
+        started = time.perf_counter()
+        cur.execute(
+            """
+            INSERT INTO cv_job_matches (cv_id, job_id, cv_text, match_score, explanation)
+            SELECT 1 + (random() * (%s - 1))::int,
+                   1 + (random() * (%s - 1))::int,
+                   NULL,
+                   random(),
+                   'Synthetic explanation for benchmarking ' || g
+            FROM generate_series(1, %s) AS g
+            """,
+            (args.cvs, args.jobs, args.rows)
+        )
+        cur.execute("ANALYZE cv_job_matches")
+        print(f"Loaded {args.rows} rows in {time.perf_counter() - started:.1f}s\n")
+
+        cur.execute("SELECT cv_id, job_id FROM cv_job_matches LIMIT 1")
+        sample_cv, sample_job = cur.fetchone()
+
+        print("========== BEFORE (no indexes) ==========\n")
+        explain(cur, "recommend_jobs_for_cv", sample_cv)
+        explain(cur, "recommend_cvs_for_job", sample_job)
+
+        started = time.perf_counter()
+        for statement in MATCH_INDEX_STATEMENTS:
+            cur.execute(statement)
+        cur.execute("ANALYZE cv_job_matches")
+        print(f"Built composite indexes in {time.perf_counter() - started:.1f}s\n")
+
+        print("========== AFTER (composite indexes) ==========\n")
+        explain(cur, "recommend_jobs_for_cv", sample_cv)
+        explain(cur, "recommend_cvs_for_job", sample_job)
+    finally:
+        if not args.keep:
+            cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        cur.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+import os
+import sys
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import multiprocessing
+
+from dotenv import load_dotenv
+
+from services.redis_pool import async_redis_client
+from services.serialization import serializer
+from services.gemini_analysis import analyze_cv_with_jobs
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# === Queue Configuration ===
+ANALYSIS_QUEUE_BACKEND = os.getenv("ANALYSIS_QUEUE_BACKEND", "redis")  # redis | local
+ANALYSIS_TASK_TTL = int(os.getenv("ANALYSIS_TASK_TTL", "86400"))  # task status and results, seconds
+ANALYSIS_WORKER_CONCURRENCY = int(os.getenv("ANALYSIS_WORKER_CONCURRENCY", "4"))  # tasks per worker process
+ANALYSIS_TASK_HEARTBEAT = int(os.getenv("ANALYSIS_TASK_HEARTBEAT", "15"))
+ANALYSIS_TASK_STALE = int(os.getenv("ANALYSIS_TASK_STALE", "120"))  # no heartbeat for this long: requeue
+ANALYSIS_TASK_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_TASK_MAX_ATTEMPTS", "3"))
+ANALYSIS_TASK_REAP_INTERVAL = float(os.getenv("ANALYSIS_TASK_REAP_INTERVAL", "15"))  # stale task scan, seconds
+# Must stay below REDIS_SOCKET_TIMEOUT, or blocking pops time out on the socket
+ANALYSIS_QUEUE_BLOCK = int(os.getenv("ANALYSIS_QUEUE_BLOCK", "2"))
+
+QUEUE_PENDING = "analysis_queue:pending"
+QUEUE_PROCESSING = "analysis_queue:processing"
+TASK_PREFIX = "analysis_task"
+
+# Task statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+# Progress of an attempt, cleared when a task is requeued or starts again
+RESET_PROGRESS = {"scored": 0, "to_score": None, "matches": 0}
+
+
+def new_task(request: dict) -> dict:
+    return {
+        "task_id": uuid.uuid4().hex,
+        "status": QUEUED,
+        "cv_id": request["cv_id"],
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "heartbeat": None,
+        "attempts": 0,
+        "scored": 0,
+        "to_score": None,
+        "matches": 0,
+        "error": None
+    }
+
+
+# Start the stale clock of a claimed task that has no heartbeat yet, without recreating an expired task
+_STAMP_HEARTBEAT = """
+if redis.call("exists", KEYS[1]) == 1 then
+    return redis.call("hsetnx", KEYS[1], "heartbeat", ARGV[1])
+end
+return 0
+"""
+
+
+class RedisTaskBackend:
+    """
+    Tasks in Redis: a pending list consumed by worker processes, one hash per task
+    (one field per task attribute, so concurrent updates never overwrite each other),
+    plus lists of partial matches and the final result, all expiring after ANALYSIS_TASK_TTL.
+
+    Queued tasks have no heartbeat field: the worker that claims one writes it
+    right after the move to the processing list.
+    """
+
+    def __init__(self, redis_client=async_redis_client):
+        self.redis = redis_client
+        self._stamp_heartbeat = redis_client.register_script(_STAMP_HEARTBEAT)
+
+    def _key(self, task_id: str, suffix: str = None) -> str:
+        return f"{TASK_PREFIX}:{task_id}" + (f":{suffix}" if suffix else "")
+
+    async def enqueue(self, request: dict) -> dict:
+        task = new_task(request)
+        task_key = self._key(task["task_id"])
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(task_key, mapping={
+                **{field: serializer.dumps(value) for field, value in task.items() if field != "heartbeat"},
+                "request": serializer.dumps(request)
+            })
+            pipe.expire(task_key, ANALYSIS_TASK_TTL)
+            pipe.lpush(QUEUE_PENDING, task["task_id"])
+            await pipe.execute()
+        return task
+
+    async def get(self, task_id: str):
+        fields = await self.redis.hgetall(self._key(task_id))
+        if not fields:
+            return None
+        task = {
+            field.decode(): serializer.loads(value)
+            for field, value in fields.items() if field != b"request"
+        }
+        task.setdefault("heartbeat", None)
+        return task
+
+    async def request(self, task_id: str):
+        raw = await self.redis.hget(self._key(task_id), "request")
+        return None if raw is None else serializer.loads(raw)
+
+    async def update(self, task_id: str, **fields):
+        task_key = self._key(task_id)
+        if not await self.redis.exists(task_key):
+            return  # expired, do not recreate it without a TTL
+        await self.redis.hset(task_key, mapping={field: serializer.dumps(value) for field, value in fields.items()})
+
+    async def add_partial(self, task_id: str, match: dict):
+        partial_key = self._key(task_id, "partial")
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.rpush(partial_key, serializer.dumps(match))
+            pipe.expire(partial_key, ANALYSIS_TASK_TTL)
+            await pipe.execute()
+
+    async def partial(self, task_id: str) -> list:
+        return [serializer.loads(raw) for raw in await self.redis.lrange(self._key(task_id, "partial"), 0, -1)]
+
+    async def clear_partial(self, task_id: str):
+        await self.redis.delete(self._key(task_id, "partial"))
+
+    async def set_result(self, task_id: str, analysis: dict):
+        await self.redis.set(self._key(task_id, "result"), serializer.dumps(analysis), ex=ANALYSIS_TASK_TTL)
+
+    async def result(self, task_id: str):
+        raw = await self.redis.get(self._key(task_id, "result"))
+        return None if raw is None else serializer.loads(raw)
+
+    # === Worker ===
+    async def _requeue_stale(self):
+        """
+        Put tasks back whose worker stopped sending heartbeats, failing them after too many attempts
+        """
+        now = time.time()
+        for raw in await self.redis.lrange(QUEUE_PROCESSING, 0, -1):
+            task_id = raw.decode()
+            task = await self.get(task_id)
+            if task is not None and task["heartbeat"] is None:
+                # Just claimed, its worker has not written the first heartbeat yet. Stamp it now
+                # instead, so a worker that died in between is caught ANALYSIS_TASK_STALE from here.
+                await self._stamp_heartbeat(keys=[self._key(task_id)], args=[serializer.dumps(now)])
+                continue
+            if task is not None and now - task["heartbeat"] < ANALYSIS_TASK_STALE:
+                continue
+            if not await self.redis.lrem(QUEUE_PROCESSING, 1, task_id):
+                continue  # another worker got there first
+            if task is None:
+                continue  # expired
+            if task["attempts"] >= ANALYSIS_TASK_MAX_ATTEMPTS:
+                await self.update(task_id, status=FAILED, finished_at=now, error="Worker lost too many times")
+            else:
+                logger.warning(f"Requeueing analysis task {task_id} after a lost worker")
+                await self.clear_partial(task_id)
+                await self.redis.hdel(self._key(task_id), "heartbeat")
+                await self.update(task_id, status=QUEUED, **RESET_PROGRESS)
+                await self.redis.lpush(QUEUE_PENDING, task_id)
+
+    async def _consume(self):
+        while True:
+            try:
+                raw = await self.redis.blmove(
+                    QUEUE_PENDING, QUEUE_PROCESSING, ANALYSIS_QUEUE_BLOCK, "RIGHT", "LEFT"
+                )
+                if raw is None:
+                    continue
+                task_id = raw.decode()
+                await self.update(task_id, heartbeat=time.time())
+                try:
+                    await execute_task(self, task_id)
+                finally:
+                    await self.redis.lrem(QUEUE_PROCESSING, 1, task_id)
+            except Exception as e:
+                logger.error(f"Analysis worker error: {e}")
+                await asyncio.sleep(1)
+
+    async def _reap(self):
+        """
+        Scan for stale tasks on a timer, so lost workers are caught even while every slot is busy
+        """
+        while True:
+            await asyncio.sleep(ANALYSIS_TASK_REAP_INTERVAL)
+            try:
+                await self._requeue_stale()
+            except Exception as e:
+                logger.error(f"Analysis reaper error: {e}")
+
+    async def run_worker(self, concurrency: int = ANALYSIS_WORKER_CONCURRENCY):
+        logger.info(f"Analysis worker {os.getpid()} consuming {QUEUE_PENDING} with {concurrency} slots")
+        await asyncio.gather(self._reap(), *(self._consume() for _ in range(concurrency)))
+
+
+class LocalTaskBackend:
+    """
+    In-process backend for tests and single-process development: tasks run as
+    asyncio tasks of the current event loop and results live in memory.
+    """
+
+    def __init__(self, concurrency: int = ANALYSIS_WORKER_CONCURRENCY):
+        self._tasks = {}
+        self._requests = {}
+        self._partials = {}
+        self._results = {}
+        self._running = set()
+        self._concurrency = concurrency
+        self._slots = None
+
+    async def enqueue(self, request: dict) -> dict:
+        task = new_task(request)
+        task_id = task["task_id"]
+        self._tasks[task_id] = task
+        self._requests[task_id] = request
+        self._partials[task_id] = []
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._concurrency)
+
+        async def run():
+            async with self._slots:
+                await execute_task(self, task_id)
+
+        runner = asyncio.create_task(run())
+        self._running.add(runner)
+        runner.add_done_callback(self._running.discard)
+        return dict(task)
+
+    async def get(self, task_id: str):
+        task = self._tasks.get(task_id)
+        return None if task is None else dict(task)
+
+    async def request(self, task_id: str):
+        return self._requests.get(task_id)
+
+    async def update(self, task_id: str, **fields):
+        if task_id in self._tasks:
+            self._tasks[task_id].update(fields)
+
+    async def add_partial(self, task_id: str, match: dict):
+        self._partials.setdefault(task_id, []).append(match)
+
+    async def partial(self, task_id: str) -> list:
+        return list(self._partials.get(task_id, []))
+
+    async def clear_partial(self, task_id: str):
+        self._partials[task_id] = []
+
+    async def set_result(self, task_id: str, analysis: dict):
+        self._results[task_id] = analysis
+
+    async def result(self, task_id: str):
+        return self._results.get(task_id)
+
+    async def join(self):
+        """
+        Wait for every enqueued task, for tests
+        """
+        while self._running:
+            await asyncio.gather(*list(self._running), return_exceptions=True)
+
+
+async def execute_task(backend, task_id: str):
+    """
+    Run one queued analysis, recording progress, partial matches and the final result on ``backend``
+    """
+    request = await backend.request(task_id)
+    task = await backend.get(task_id)
+    if request is None or task is None:
+        logger.warning(f"Analysis task {task_id} expired before it ran")
+        return
+
+    # A previous attempt may have left partial matches and counters behind
+    await backend.clear_partial(task_id)
+    now = time.time()
+    await backend.update(
+        task_id, status=RUNNING, started_at=now, heartbeat=now, attempts=task["attempts"] + 1,
+        error=None, **RESET_PROGRESS
+    )
+    progress = {"matches": 0}
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(ANALYSIS_TASK_HEARTBEAT)
+            await backend.update(task_id, heartbeat=time.time())
+
+    async def on_event(event: dict):
+        if event["event"] == "plan":
+            await backend.update(task_id, to_score=event["scored_pairs"], heartbeat=time.time())
+        elif event["event"] == "match":
+            progress["matches"] += 1
+            await backend.add_partial(task_id, event["match"])
+            await backend.update(task_id, matches=progress["matches"])
+        elif event["event"] == "progress":
+            await backend.update(task_id, scored=event["scored"], heartbeat=time.time())
+
+    beating = asyncio.create_task(heartbeat())
+    try:
+        analysis = await analyze_cv_with_jobs(
+            request["cv_text"], request["cv_id"], request.get("top_k"), request.get("min_similarity"),
+            stale_while_revalidate=False, batch_size=request.get("batch_size"), on_event=on_event
+        )
+        await backend.set_result(task_id, analysis)
+        await backend.update(
+            task_id, status=DONE, finished_at=time.time(), matches=len(analysis["matches"]), error=None
+        )
+    except Exception as e:
+        logger.error(f"Analysis task {task_id} failed: {e}")
+        await backend.update(task_id, status=FAILED, finished_at=time.time(), error=str(e))
+    finally:
+        beating.cancel()
+
+
+def get_backend(name: str = ANALYSIS_QUEUE_BACKEND):
+    if name == "local":
+        return LocalTaskBackend()
+    if name == "redis":
+        return RedisTaskBackend()
+    raise ValueError(f"Unknown ANALYSIS_QUEUE_BACKEND {name!r}, expected 'redis' or 'local'")
+
+
+analysis_queue = get_backend()
+
+
+def _worker_process(concurrency: int):
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(RedisTaskBackend().run_worker(concurrency))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run analysis queue workers")
+    parser.add_argument("command", choices=["worker"])
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=ANALYSIS_WORKER_CONCURRENCY)
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        _worker_process(args.concurrency)
+        sys.exit(0)
+
+    workers = [
+        multiprocessing.Process(target=_worker_process, args=(args.concurrency,), daemon=False)
+        for _ in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
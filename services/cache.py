@@ -0,0 +1,404 @@
+import os
+import sys
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import namedtuple, defaultdict
+
+from dotenv import load_dotenv
+
+from services.redis_pool import redis_client, async_redis_client
+from services.serialization import serializer
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# === Cache Key Schemas ===
+# Every cached payload family owns a prefix, a schema version and a TTL. Bump the
+# version whenever the stored shape changes: readers then miss instead of parsing
+# an old payload, and `python -m services.cache purge` drops the old keys.
+# Families with a stale_ttl also keep a "<key>:stale" copy that outlives the fresh
+# key by that long, served while a single-flight recompute is in progress.
+CacheFamily = namedtuple("CacheFamily", ["prefix", "version", "ttl", "stale_ttl"], defaults=[0])
+
+# Top-10 job rows for a CV, from cv_job_matches
+RECOMMEND_CV = CacheFamily("recommend:cv", 3, int(os.getenv("RECOMMEND_CV_CACHE_TTL", "3600")))
+# Top-10 CV rows for a job, kept fresh by write-through (TTL is only a safety net)
+RECOMMEND_JOB = CacheFamily("recommend:job", 2, int(os.getenv("RECOMMEND_JOB_CACHE_TTL", "86400")))
+# Full analyze_cv_with_jobs response
+NLI_ANALYSIS = CacheFamily("nli_analysis:cv", 3, int(os.getenv("NLI_ANALYSIS_CACHE_TTL", "1800")),
+                           int(os.getenv("NLI_ANALYSIS_STALE_TTL", "86400")))
+# Gemini re-ranked related jobs
+RELATED_JOBS = CacheFamily("related_jobs", 3, int(os.getenv("RELATED_JOBS_CACHE_TTL", "10800")),
+                           int(os.getenv("RELATED_JOBS_STALE_TTL", "86400")))
+
+# Normalized, token-budgeted CV / job text, keyed by budget and content hash.
+# Bump the version when services.preprocess rules change.
+CANONICAL_TEXT = CacheFamily("canonical_text", 2, int(os.getenv("CANONICAL_TEXT_CACHE_TTL", "604800")))
+
+CACHE_FAMILIES = [RECOMMEND_CV, RECOMMEND_JOB, NLI_ANALYSIS, RELATED_JOBS, CANONICAL_TEXT]
+
+# === Single-Flight Configuration ===
+CACHE_LOCK_LEASE = int(os.getenv("CACHE_LOCK_LEASE", "120"))  # seconds, renewed while computing
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", "180"))  # max seconds a waiter polls for the result
+CACHE_LOCK_POLL = float(os.getenv("CACHE_LOCK_POLL", "0.25"))
+CACHE_STALE_WHILE_REVALIDATE = os.getenv("CACHE_STALE_WHILE_REVALIDATE", "false").lower() == "true"
+
+
+class CacheLockTimeout(TimeoutError):
+    """
+    Another worker still holds the recompute lock after CACHE_LOCK_WAIT seconds
+    """
+
+
+def cache_key(family: CacheFamily, *parts) -> str:
+    return f"{family.prefix}:v{family.version}:" + ":".join(str(part) for part in parts)
+
+
+def stale_key(key: str) -> str:
+    return f"{key}:stale"
+
+
+def version_key(key: str) -> str:
+    return f"{key}:version"
+
+
+# === Cache Access ===
+# One GET per lookup (no EXISTS + GET race), MGET / pipelines for batches, and
+# hit ratios per key family. Values are encoded by services.serialization.
+_stats_lock = threading.Lock()
+_family_stats = defaultdict(lambda: {"hits": 0, "misses": 0, "stale_hits": 0, "coalesced": 0, "computed": 0})
+
+
+def _record(family: CacheFamily, hits: int = 0, misses: int = 0, **counters):
+    with _stats_lock:
+        stats = _family_stats[family.prefix]
+        stats["hits"] += hits
+        stats["misses"] += misses
+        for counter, count in counters.items():
+            stats[counter] += count
+
+
+def _decode(raw):
+    return None if raw is None else serializer.loads(raw)
+
+
+def _decode_many(family: CacheFamily, ids, raws):
+    values = {item_id: _decode(raw) for item_id, raw in zip(ids, raws)}
+    hits = sum(value is not None for value in values.values())
+    _record(family, hits, len(values) - hits)
+    return values
+
+
+def cache_get(family: CacheFamily, *parts):
+    value = _decode(redis_client.get(cache_key(family, *parts)))
+    _record(family, value is not None, value is None)
+    return value
+
+
+def cache_mget(family: CacheFamily, ids: list):
+    """
+    {id: value or None} for many ids of one family in a single MGET
+    """
+    if not ids:
+        return {}
+    return _decode_many(family, ids, redis_client.mget([cache_key(family, item_id) for item_id in ids]))
+
+
+def _queue_set(pipe, family: CacheFamily, key: str, payload: str):
+    pipe.set(key, payload, ex=family.ttl)
+    if family.stale_ttl:
+        pipe.set(stale_key(key), payload, ex=family.ttl + family.stale_ttl)
+
+
+def cache_set(family: CacheFamily, value, *parts):
+    with redis_client.pipeline(transaction=False) as pipe:
+        _queue_set(pipe, family, cache_key(family, *parts), serializer.dumps(value))
+        pipe.execute()
+
+
+def cache_set_many(family: CacheFamily, values: dict):
+    """
+    Store {id: value} with the family TTL in one pipelined round trip
+    """
+    if not values:
+        return
+    with redis_client.pipeline(transaction=False) as pipe:
+        for item_id, value in values.items():
+            _queue_set(pipe, family, cache_key(family, item_id), serializer.dumps(value))
+        pipe.execute()
+
+
+# === Versioned Writes ===
+# A reader that misses and loads from PostgreSQL must not store what it read after a
+# writer changed the rows and skipped the absent key. Writers bump "<key>:version";
+# the reader notes the version before its query and stores only if it is unchanged.
+_SET_IF_VERSION = """
+if (redis.call("get", KEYS[2]) or "") == ARGV[1] then
+    return redis.call("set", KEYS[1], ARGV[2], "EX", ARGV[3])
+end
+return 0
+"""
+_set_if_version = redis_client.register_script(_SET_IF_VERSION)
+
+
+def cache_version(family: CacheFamily, *parts) -> str:
+    raw = redis_client.get(version_key(cache_key(family, *parts)))
+    return raw.decode() if raw else ""
+
+
+def bump_cache_versions(family: CacheFamily, ids: list):
+    """
+    Mark the values of ``ids`` as changed, called before their cached copies are updated
+    """
+    if not ids:
+        return
+    with redis_client.pipeline(transaction=False) as pipe:
+        for item_id in ids:
+            key = version_key(cache_key(family, item_id))
+            pipe.incr(key)
+            pipe.expire(key, family.ttl)
+        pipe.execute()
+
+
+def cache_set_if_version(family: CacheFamily, value, version: str, *parts) -> bool:
+    """
+    Store ``value`` only if no writer bumped the key's version since ``cache_version`` returned ``version``
+    """
+    key = cache_key(family, *parts)
+    stored = _set_if_version(keys=[key, version_key(key)], args=[version, serializer.dumps(value), family.ttl])
+    return bool(stored)
+
+
+def cache_versions(family: CacheFamily, ids: list) -> dict:
+    """
+    {id: version} for many ids of one family in a single MGET
+    """
+    if not ids:
+        return {}
+    raws = redis_client.mget([version_key(cache_key(family, item_id)) for item_id in ids])
+    return {item_id: raw.decode() if raw else "" for item_id, raw in zip(ids, raws)}
+
+
+def cache_set_many_if_version(family: CacheFamily, values: dict, versions: dict) -> int:
+    """
+    ``cache_set_if_version`` for {id: value} in one pipelined round trip, returns how many were stored
+    """
+    if not values:
+        return 0
+    with redis_client.pipeline(transaction=False) as pipe:
+        for item_id, value in values.items():
+            key = cache_key(family, item_id)
+            _set_if_version(
+                keys=[key, version_key(key)], args=[versions[item_id], serializer.dumps(value), family.ttl],
+                client=pipe
+            )
+        return sum(1 for stored in pipe.execute() if stored)
+
+
+async def acache_get(family: CacheFamily, *parts):
+    value = _decode(await async_redis_client.get(cache_key(family, *parts)))
+    _record(family, value is not None, value is None)
+    return value
+
+
+async def acache_set_many(family: CacheFamily, values: dict):
+    if not values:
+        return
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for item_id, value in values.items():
+            _queue_set(pipe, family, cache_key(family, item_id), serializer.dumps(value))
+        await pipe.execute()
+
+
+async def acache_mget(family: CacheFamily, ids: list):
+    if not ids:
+        return {}
+    raws = await async_redis_client.mget([cache_key(family, item_id) for item_id in ids])
+    return _decode_many(family, ids, raws)
+
+
+async def acache_set(family: CacheFamily, value, *parts):
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        _queue_set(pipe, family, cache_key(family, *parts), serializer.dumps(value))
+        await pipe.execute()
+
+
+# === Single-Flight Recompute ===
+# On a miss only the worker holding "<key>:lock" computes the value. The lock is a
+# SET NX with a lease that the holder keeps renewing, so a crashed worker frees it
+# within CACHE_LOCK_LEASE seconds. Everyone else returns the stale copy when there
+# is one, or polls until the holder has written the fresh value or its lease lapsed.
+# Nobody computes while the lock exists: waiters give up with CacheLockTimeout.
+_RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+_RENEW_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+_release_lock = async_redis_client.register_script(_RELEASE_LOCK)
+_renew_lock = async_redis_client.register_script(_RENEW_LOCK)
+
+# Strong references to background refreshes, the event loop only keeps weak ones
+_refresh_tasks = set()
+
+
+async def _renew_lease(lock_key: str, token: str):
+    while True:
+        await asyncio.sleep(CACHE_LOCK_LEASE / 3)
+        await _renew_lock(keys=[lock_key], args=[token, CACHE_LOCK_LEASE * 1000])
+
+
+async def _compute_locked(family: CacheFamily, compute, parts, lock_key: str, token: str):
+    """
+    Run ``compute`` while holding the lock, store and return its value
+    """
+    renewer = asyncio.create_task(_renew_lease(lock_key, token))
+    try:
+        value = await compute()
+        await acache_set(family, value, *parts)
+        _record(family, computed=1)
+        return value
+    finally:
+        renewer.cancel()
+        try:
+            await _release_lock(keys=[lock_key], args=[token])
+        except Exception as e:
+            logger.warning(f"Failed to release {lock_key}, it expires with its lease: {e}")
+
+
+async def _refresh_in_background(family: CacheFamily, compute, parts, lock_key: str, token: str):
+    try:
+        await _compute_locked(family, compute, parts, lock_key, token)
+    except Exception as e:
+        logger.error(f"Background refresh of {cache_key(family, *parts)} failed: {e}")
+
+
+async def acache_single_flight(family: CacheFamily, compute, *parts, stale_while_revalidate: bool = None):
+    """
+    Cached value of ``await compute()``, computed by one caller across all workers per key.
+
+    With stale-while-revalidate the lock holder itself answers from the stale copy
+    and recomputes in the background.
+    """
+    if stale_while_revalidate is None:
+        stale_while_revalidate = CACHE_STALE_WHILE_REVALIDATE
+
+    value = await acache_get(family, *parts)
+    if value is not None:
+        return value
+
+    key = cache_key(family, *parts)
+    lock_key = f"{key}:lock"
+    stale = _decode(await async_redis_client.get(stale_key(key))) if family.stale_ttl else None
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    token = uuid.uuid4().hex
+
+    while True:
+        if await async_redis_client.set(lock_key, token, nx=True, ex=CACHE_LOCK_LEASE):
+            raw = await async_redis_client.get(key)
+            if raw is not None:  # the previous holder finished between our GET and SET NX
+                await _release_lock(keys=[lock_key], args=[token])
+                _record(family, coalesced=1)
+                return _decode(raw)
+            if stale is not None and stale_while_revalidate:
+                task = asyncio.create_task(_refresh_in_background(family, compute, parts, lock_key, token))
+                _refresh_tasks.add(task)
+                task.add_done_callback(_refresh_tasks.discard)
+                _record(family, stale_hits=1)
+                return stale
+            return await _compute_locked(family, compute, parts, lock_key, token)
+
+        if stale is not None:
+            _record(family, stale_hits=1)
+            return stale
+
+        # Someone else is computing: wait for their result, or for their lease to lapse
+        await asyncio.sleep(CACHE_LOCK_POLL)
+        raw = await async_redis_client.get(key)
+        if raw is not None:
+            _record(family, coalesced=1)
+            return _decode(raw)
+        if time.monotonic() >= deadline:
+            # The holder is alive (it keeps renewing its lease): computing too would duplicate its work
+            logger.warning(f"Gave up waiting for {lock_key} after {CACHE_LOCK_WAIT}s")
+            raise CacheLockTimeout(f"{key} is still being computed by another worker, retry later")
+
+
+def cache_stats():
+    """
+    Hit/miss counters and hit ratio per key family (per worker process)
+    """
+    with _stats_lock:
+        stats = {prefix: dict(values) for prefix, values in _family_stats.items()}
+    for values in stats.values():
+        lookups = values["hits"] + values["misses"]
+        values["hit_ratio"] = round(values["hits"] / lookups, 4) if lookups else None
+    return stats
+
+
+# === Invalidation ===
+def invalidate_cv(cv_id: int):
+    """
+    Drop every per-CV payload, called after new matches are written for the CV.
+
+    The recommendation version is bumped too, so a reader that queried the old
+    rows cannot store them back after the delete.
+    """
+    recommend_key = cache_key(RECOMMEND_CV, cv_id)
+    nli_key = cache_key(NLI_ANALYSIS, cv_id)
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.incr(version_key(recommend_key))
+        pipe.expire(version_key(recommend_key), RECOMMEND_CV.ttl)
+        pipe.delete(recommend_key, nli_key, stale_key(nli_key))
+        pipe.execute()
+
+
+def invalidate_related_jobs(job_ids):
+    """
+    Drop re-ranked related jobs of jobs that were edited, removed, or whose neighbours changed
+    """
+    keys = []
+    for job_id in job_ids:
+        key = cache_key(RELATED_JOBS, job_id)
+        keys += [key, stale_key(key)]
+    for start in range(0, len(keys), 500):
+        redis_client.delete(*keys[start:start + 500])
+
+
+def purge_stale_versions(count: int = 1000):
+    """
+    Delete keys of every family that are not on the family's current version, returns keys deleted
+    """
+    deleted = 0
+    for family in CACHE_FAMILIES:
+        current = f"{family.prefix}:v{family.version}:".encode()
+        stale = []
+        for key in redis_client.scan_iter(match=f"{family.prefix}:*", count=count):
+            if not key.startswith(current):
+                stale.append(key)
+            if len(stale) >= 500:
+                deleted += redis_client.delete(*stale)
+                stale = []
+        if stale:
+            deleted += redis_client.delete(*stale)
+    return deleted
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] == ["purge"]:
+        print(f"Deleted {purge_stale_versions()} stale cache keys")
+    else:
+        for family in CACHE_FAMILIES:
+            print(f"{family.prefix}:v{family.version}:*  ttl={family.ttl}s  stale_ttl={family.stale_ttl}s")
@@ -1,7 +1,13 @@
 import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
 
 import redis
 import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from dotenv import load_dotenv
 
 from fastapi import HTTPException
@@ -15,9 +21,19 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.agents import initialize_agent, Tool, AgentType
 import os
 
+from services.hashing import content_hash
+from services.redis_pool import redis_client
+from services.serialization import serializer
+from services.cache import (
+    RECOMMEND_CV, RECOMMEND_JOB, cache_key, cache_get, cache_mget, invalidate_cv,
+    cache_version, cache_versions, cache_set_if_version, cache_set_many_if_version, bump_cache_versions
+)
+
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # === Database Configuration ===
 DATABASE_URL = f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}@" \
                f"{os.getenv('POSTGRES_HOST')}:{os.getenv('POSTGRES_PORT')}/{os.getenv('POSTGRES_DB')}"
@@ -26,13 +42,6 @@ engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-# === Redis Configuration ===
-red = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=os.getenv("REDIS_PORT"),
-    db=int(os.getenv("REDIS_DB"))
-)
-
 # === Gemini Model ===
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro-latest", temperature=0.3)
@@ -64,6 +73,125 @@ def connect():
     )
 
 
+# === PostgreSQL Connection Pool ===
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", "1"))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "20"))
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+POSTGRES_POOL_HEALTHCHECK_IDLE = float(os.getenv("POSTGRES_POOL_HEALTHCHECK_IDLE", "30"))  # ping after this idle time
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POSTGRES_POOL_MAX)
+_pool_last_used = {}
+_pool_stats = {
+    "checkouts": 0,
+    "in_use": 0,
+    "peak_in_use": 0,
+    "waits": 0,
+    "wait_time_ms": 0.0,
+    "timeouts": 0,
+    "health_checks": 0,
+    "discarded": 0
+}
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    POSTGRES_POOL_MIN,
+                    POSTGRES_POOL_MAX,
+                    host=os.getenv("POSTGRES_HOST"),
+                    port=os.getenv("POSTGRES_PORT"),
+                    dbname=os.getenv("POSTGRES_DB"),
+                    user=os.getenv("POSTGRES_USER"),
+                    password=os.getenv("POSTGRES_PASSWORD2")
+                )
+    return _pool
+
+
+def _is_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - _pool_last_used.get(id(conn), 0) < POSTGRES_POOL_HEALTHCHECK_IDLE:
+        return True
+    with _pool_lock:
+        _pool_stats["health_checks"] += 1
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+@contextmanager
+def get_connection():
+    """
+    Borrow a pooled connection; rolled back on error and always returned to the pool
+    """
+    started = time.monotonic()
+    # ThreadedConnectionPool raises instead of blocking when exhausted, so queue on a semaphore
+    if not _pool_slots.acquire(blocking=False):
+        with _pool_lock:
+            _pool_stats["waits"] += 1
+        if not _pool_slots.acquire(timeout=POSTGRES_POOL_TIMEOUT):
+            with _pool_lock:
+                _pool_stats["timeouts"] += 1
+            raise PoolError(f"No PostgreSQL connection available after {POSTGRES_POOL_TIMEOUT}s")
+
+    # The slot is released even if returning the connection fails
+    try:
+        pool = get_pool()
+        conn = None
+        try:
+            conn = pool.getconn()
+            while not _is_healthy(conn):
+                _pool_last_used.pop(id(conn), None)
+                pool.putconn(conn, close=True)
+                conn = None  # already returned: a failing getconn below must not return it again
+                with _pool_lock:
+                    _pool_stats["discarded"] += 1
+                conn = pool.getconn()
+
+            with _pool_lock:
+                _pool_stats["checkouts"] += 1
+                _pool_stats["in_use"] += 1
+                _pool_stats["peak_in_use"] = max(_pool_stats["peak_in_use"], _pool_stats["in_use"])
+                _pool_stats["wait_time_ms"] += (time.monotonic() - started) * 1000
+
+            try:
+                yield conn
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                with _pool_lock:
+                    _pool_stats["in_use"] -= 1
+        finally:
+            if conn is not None:
+                _pool_last_used[id(conn)] = time.monotonic()
+                pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        _pool_slots.release()
+
+
+def pool_stats():
+    with _pool_lock:
+        stats = dict(_pool_stats)
+    stats["wait_time_ms"] = round(stats["wait_time_ms"], 2)
+    stats["min_size"] = POSTGRES_POOL_MIN
+    stats["max_size"] = POSTGRES_POOL_MAX
+    if _pool is not None:
+        stats["open_connections"] = len(_pool._pool) + len(_pool._used)
+        stats["idle_connections"] = len(_pool._pool)
+    return stats
+
+
 # === Fetch Active Jobs ===
 def get_all_jobs():
     with SessionLocal() as session:
@@ -80,105 +208,309 @@ def get_all_jobs():
             for job in jobs
         ]
 
-def get_relative_jobs(job_id: int):
+# === Fetch Every Job for the Embedding Index ===
+def get_jobs_for_index():
+    with SessionLocal() as session:
+        now = func.now()
+        active = (Job.end_date > now) & (Job.enable == True)
+        rows = session.query(Job.id, Job.detail, active.label("active")).all()
+        return [
+            {"id": row.id, "detail": row.detail, "active": bool(row.active)}
+            for row in rows
+        ]
+
+def get_job(job_id: int):
     with SessionLocal() as session:
         job = session.query(Job).filter(Job.id == job_id).first()
         if not job:
             raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+def get_active_jobs_by_ids(job_ids: list):
+    if not job_ids:
+        return []
+    with SessionLocal() as session:
         now = func.now()
-        other_jobs = session.query(Job).filter(
+        return session.query(Job).filter(
+            Job.id.in_(job_ids),
             Job.end_date > now,
-            Job.enable == True,
-            Job.id != job_id
+            Job.enable == True
         ).all()
-    return other_jobs, job
 
 
-# === Save NLI Analysis for a CV ===
-def save_nli_analysis(cv_id: int, results: list):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO nli_analysis (cv_id, analysis) VALUES (%s, %s)",
-        (cv_id, json.dumps(results))
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
-
-# === Save a Match between CV and Job ===
-def save_cv_job_matches(cv_id: int, job_id: int, cv_text: str, score: float, explanation: str):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO cv_job_matches (cv_id, job_id, cv_text, match_score, explanation)
-        VALUES (%s, %s, %s, %s, %s)
-        """,
-        (cv_id, job_id, cv_text, score, explanation)
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+# === Save an Analysis Run ===
+def save_analysis_results(cv_id: int, cv_text: str, matches: list, analysis: list, fingerprints: list):
+    """
+    Write a run's CV document, matches, NLI analysis and pair fingerprints in one transaction.
+
+    ``matches`` holds (job_id, score, explanation) rows upserted on (cv_id, job_id);
+    ``fingerprints`` holds (job_id, fingerprint, score) rows for every pair scored.
+    Stored matches of pairs rescored below 0.5 are deleted.
+    """
+    matched = {job_id for job_id, _, _ in matches}
+    unmatched = [job_id for job_id, _, score in fingerprints if score < 0.5 and job_id not in matched]
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO cv_documents (cv_id, content_hash, cv_text)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (cv_id) DO UPDATE
+            SET content_hash = EXCLUDED.content_hash,
+                cv_text = EXCLUDED.cv_text,
+                updated_at = now()
+            WHERE cv_documents.content_hash <> EXCLUDED.content_hash
+            """,
+            (cv_id, content_hash(cv_text), cv_text)
+        )
+        if matches:
+            execute_values(
+                cur,
+                """
+                INSERT INTO cv_job_matches (cv_id, job_id, match_score, explanation)
+                VALUES %s
+                ON CONFLICT (cv_id, job_id) DO UPDATE
+                SET match_score = EXCLUDED.match_score,
+                    explanation = EXCLUDED.explanation
+                """,
+                [(cv_id, job_id, score, explanation) for job_id, score, explanation in matches]
+            )
+        removed = []
+        if unmatched:
+            cur.execute(
+                "DELETE FROM cv_job_matches WHERE cv_id = %s AND job_id = ANY(%s) RETURNING job_id",
+                (cv_id, unmatched)
+            )
+            removed = sorted({r[0] for r in cur.fetchall()})
+        cur.execute(
+            "INSERT INTO nli_analysis (cv_id, analysis) VALUES (%s, %s)",
+            (cv_id, json.dumps(analysis))
+        )
+        if fingerprints:
+            execute_values(
+                cur,
+                """
+                INSERT INTO cv_job_fingerprints (cv_id, job_id, fingerprint, match_score)
+                VALUES %s
+                ON CONFLICT (cv_id, job_id) DO UPDATE
+                SET fingerprint = EXCLUDED.fingerprint,
+                    match_score = EXCLUDED.match_score,
+                    updated_at = now()
+                """,
+                [(cv_id, job_id, fingerprint, score) for job_id, fingerprint, score in fingerprints]
+            )
+        conn.commit()
+        cur.close()
+
+    invalidate_cv(cv_id)
+    update_job_recommendation_caches(cv_id, matches, removed)
+
+
+# === Per-(CV, Job) Fingerprints ===
+def get_pair_fingerprints(cv_id: int):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT job_id, fingerprint, match_score FROM cv_job_fingerprints WHERE cv_id = %s",
+            (cv_id,)
+        )
+        rows = cur.fetchall()
+        cur.close()
+    return {r[0]: (r[1], float(r[2])) for r in rows}
+
+def get_stored_matches(cv_id: int, job_ids: list):
+    if not job_ids:
+        return {}
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT DISTINCT ON (job_id) job_id, match_score, explanation
+            FROM cv_job_matches
+            WHERE cv_id = %s AND job_id = ANY(%s)
+            ORDER BY job_id, match_score DESC
+            """,
+            (cv_id, list(job_ids))
+        )
+        rows = cur.fetchall()
+        cur.close()
+    return {r[0]: (float(r[1]), r[2]) for r in rows}
 
 
 # === Recommend Jobs for a CV ===
 def recommend_jobs_for_cv(cv_id: int):
-    cache_key = f"recommend:cv:{cv_id}"
-    if red.exists(cache_key):
-        return red.get(cache_key).decode()
-
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT job_id, match_score, explanation
-        FROM cv_job_matches
-        WHERE cv_id = %s
-        ORDER BY match_score DESC
-        LIMIT 10
-        """,
-        (cv_id,)
-    )
+    cached = cache_get(RECOMMEND_CV, cv_id)
+    if cached is not None:
+        return json.dumps(cached)
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    # Noted before the query: saving new matches bumps it and our rows are not cached
+    version = cache_version(RECOMMEND_CV, cv_id)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT job_id, match_score, explanation
+            FROM cv_job_matches
+            WHERE cv_id = %s
+            ORDER BY match_score DESC
+            LIMIT 10
+            """,
+            (cv_id,)
+        )
+
+        rows = cur.fetchall()
+        cur.close()
 
     result = [{"job_id": r[0], "score": float(r[1]), "explanation": r[2]} for r in rows]
-    red.set(cache_key, json.dumps(result))
+    cache_set_if_version(RECOMMEND_CV, result, version, cv_id)
     return json.dumps(result)
 
+def recommend_jobs_for_cvs(cv_ids: list):
+    """
+    Top-10 jobs for many CVs: one MGET, one query for the misses, one pipelined write-back
+    """
+    results = cache_mget(RECOMMEND_CV, cv_ids)
+    missing = [cv_id for cv_id, cached in results.items() if cached is None]
+    if not missing:
+        return results
+
+    versions = cache_versions(RECOMMEND_CV, missing)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT cv_id, job_id, match_score, explanation
+            FROM (
+                SELECT cv_id, job_id, match_score, explanation,
+                       ROW_NUMBER() OVER (PARTITION BY cv_id ORDER BY match_score DESC) AS rank
+                FROM cv_job_matches
+                WHERE cv_id = ANY(%s)
+            ) ranked
+            WHERE rank <= 10
+            ORDER BY cv_id, match_score DESC
+            """,
+            (missing,)
+        )
+
+        rows = cur.fetchall()
+        cur.close()
+
+    loaded = {cv_id: [] for cv_id in missing}
+    for cv_id, job_id, score, explanation in rows:
+        loaded[cv_id].append({"job_id": job_id, "score": float(score), "explanation": explanation})
+    cache_set_many_if_version(RECOMMEND_CV, loaded, versions)
+    results.update(loaded)
+    return results
+
 # === Recommend CVs for a Job ===
+RECOMMEND_LIMIT = 10
+
 def recommend_cvs_for_job(job_id: int):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT cv_id, match_score, explanation
-        FROM cv_job_matches
-        WHERE job_id = %s
-        ORDER BY match_score DESC
-        LIMIT 10
-        """,
-        (job_id,)
-    )
+    cached = cache_get(RECOMMEND_JOB, job_id)
+    if cached is not None:
+        return json.dumps(cached)
+
+    # Noted before the query: a match saved meanwhile bumps it and our rows are not cached
+    version = cache_version(RECOMMEND_JOB, job_id)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT cv_id, match_score, explanation
+            FROM cv_job_matches
+            WHERE job_id = %s
+            ORDER BY match_score DESC
+            LIMIT 10
+            """,
+            (job_id,)
+        )
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+        rows = cur.fetchall()
+        cur.close()
 
     result = [{"cv_id": r[0], "score": float(r[1]), "explanation": r[2]} for r in rows]
+    cache_set_if_version(RECOMMEND_JOB, result, version, job_id)
     return json.dumps(result)
 
+def _merge_job_recommendation(cached: list, cv_id: int, score: float, explanation: str):
+    """
+    Apply one upserted match (``score`` None: deleted match) to a cached top-N list,
+    or None when the list can no longer be trusted
+    """
+    previous = next((entry for entry in cached if entry["cv_id"] == cv_id), None)
+    if score is None and previous is None:
+        return cached
+    # A full list whose entry dropped below every cached score (or left) may now hide an uncached row
+    if previous and len(cached) >= RECOMMEND_LIMIT and (
+        score is None or score < min(entry["score"] for entry in cached)
+    ):
+        return None
+
+    merged = [entry for entry in cached if entry["cv_id"] != cv_id]
+    if score is not None:
+        merged.append({"cv_id": cv_id, "score": float(score), "explanation": explanation})
+    merged.sort(key=lambda entry: entry["score"], reverse=True)
+    return merged[:RECOMMEND_LIMIT]
+
+def update_job_recommendation_caches(cv_id: int, matches: list, removed: list = ()):
+    """
+    Write-through for recommend:job:* after (job_id, score, explanation) matches were saved
+    for a CV and the matches with the ``removed`` job ids were deleted
+    """
+    changes = list(matches) + [(job_id, None, None) for job_id in removed]
+    try:
+        # Readers that loaded these jobs from PostgreSQL before the save must not cache their rows
+        bump_cache_versions(RECOMMEND_JOB, [job_id for job_id, _, _ in changes])
+    except redis.RedisError as e:
+        logger.warning(f"Failed to bump recommend:job versions for CV {cv_id}: {e}")
+    for job_id, score, explanation in changes:
+        key = cache_key(RECOMMEND_JOB, job_id)
+        try:
+            with redis_client.pipeline() as pipe:
+                while True:
+                    try:
+                        pipe.watch(key)
+                        raw = pipe.get(key)
+                        if raw is None:
+                            pipe.unwatch()  # nothing cached, the next read loads it from PostgreSQL
+                            break
+                        merged = _merge_job_recommendation(serializer.loads(raw), cv_id, score, explanation)
+                        pipe.multi()
+                        if merged is None:
+                            pipe.delete(key)
+                        else:
+                            pipe.set(key, serializer.dumps(merged), keepttl=True)
+                        pipe.execute()
+                        break
+                    except redis.WatchError:
+                        continue
+        except Exception as e:
+            logger.warning(f"Failed to update {key}, dropping it: {e}")
+            try:
+                redis_client.delete(key)
+            except redis.RedisError:
+                pass
+
 # === Get all CVs and Text for Filtering ===
 def get_cv_for_filter():
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT cv_id, cv_text FROM cv_job_matches")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    """
+    One row per distinct CV text: (content_hash, cv_text, [cv_ids sharing that text])
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT d.content_hash, d.cv_text, g.cv_ids
+            FROM (
+                SELECT content_hash, array_agg(cv_id ORDER BY cv_id) AS cv_ids, min(cv_id) AS first_cv_id
+                FROM cv_documents
+                GROUP BY content_hash
+            ) g
+            JOIN cv_documents d ON d.cv_id = g.first_cv_id
+            """
+        )
+        rows = cur.fetchall()
+        cur.close()
     return rows
 
 # === AI Agent Tools ===
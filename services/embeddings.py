@@ -0,0 +1,65 @@
+import os
+import logging
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# === Embedding Configuration ===
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_embedding_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                logger.info(f"Loading embedding model {EMBEDDING_MODEL_NAME}")
+                _model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _model
+
+
+def embed_texts(texts: list) -> np.ndarray:
+    """
+    Embed texts into L2-normalized float32 vectors, so a dot product is the cosine similarity
+    """
+    if not texts:
+        return np.empty((0, get_embedding_model().get_sentence_embedding_dimension()), dtype=np.float32)
+
+    vectors = get_embedding_model().encode(
+        [text or "" for text in texts],
+        batch_size=EMBEDDING_BATCH_SIZE,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False
+    )
+    return vectors.astype(np.float32, copy=False)
+
+
+def top_k_by_similarity(query: np.ndarray, matrix: np.ndarray, top_k: int, min_similarity: float):
+    """
+    Return (row indices, similarities) of the best matching rows, best first
+    """
+    if matrix.shape[0] == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    similarities = matrix @ query
+    candidates = np.flatnonzero(similarities >= min_similarity)
+
+    if top_k > 0 and candidates.size > top_k:
+        best = np.argpartition(-similarities[candidates], top_k - 1)[:top_k]
+        candidates = candidates[best]
+
+    order = np.argsort(-similarities[candidates], kind="stable")
+    candidates = candidates[order]
+    return candidates, similarities[candidates]
@@ -1,10 +1,11 @@
 import os
 import re
 import json
-import redis
+import time
+import asyncio
 import logging
 from datetime import datetime
-import concurrent.futures
+from typing import Optional
 from dotenv import load_dotenv
 
 from weasyprint import HTML
@@ -12,19 +13,29 @@ from pdf2image import convert_from_path
 import base64
 from io import BytesIO
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from langchain_core.prompts import PromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.chains import LLMChain
 from pydantic import BaseModel
 
 from services.database import (
-    save_nli_analysis,
-    save_cv_job_matches,
+    save_analysis_results,
     get_all_jobs,
     get_cv_for_filter,
-    get_relative_jobs
+    get_job,
+    get_active_jobs_by_ids,
+    get_pair_fingerprints,
+    get_stored_matches
 )
+from services.job_index import PREFILTER_MIN_SIMILARITY, PREFILTER_TOP_K, prefilter_jobs
+from services.job_neighbors import job_neighbors
+from services.llm_cache import LLMResponseCache, prompt_version
+from services.llm_client import LLMCallStats, LLMDeadlineExceeded, is_retryable
+from services.tokens import count_tokens
+from services.preprocess import CV_TOKEN_BUDGET, JOB_TOKEN_BUDGET, canonicalize, canonicalize_many
+from services.hashing import content_hash, fingerprint
+from services.cache import NLI_ANALYSIS, RELATED_JOBS, acache_single_flight
+from services.redis_pool import async_redis_client
 
 # Load environment variables
 load_dotenv()
@@ -33,17 +44,14 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure Gemini API and Redis
+# Configure Gemini API
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 
 
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.3)
+# Retries and backoff are owned by services.llm_client, not by the client library
+llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.3, max_retries=1)
 
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=int(os.getenv("REDIS_PORT")),
-    db=int(os.getenv("REDIS_DB"))
-)
+llm_cache = LLMResponseCache(async_redis_client)
 
 os.environ['FONTCONFIG_PATH'] = r"C:\Program Files\GTK3-Runtime Win64\etc\fonts"
 
@@ -58,8 +66,7 @@ def extract_score(text: str) -> float:
 
 
 # ========== NLI Analysis ==========
-def analyze_single_job(cv_id, cv_text, job):
-    prompt_template = PromptTemplate.from_template("""
+MATCH_PROMPT = PromptTemplate.from_template("""
     You are a professional AI recruitment assistant.
 
     Your task is to compare the following CV and Job Description, and assess how well the CV matches the job.
@@ -84,80 +91,326 @@ def analyze_single_job(cv_id, cv_text, job):
     {job_detail}
     """)
 
-    chain = prompt_template | llm  # ensure `llm` is initialized
 
-    try:
-        response = chain.invoke({
-            "cv_text": cv_text,
-            "job_detail": job['detail']
-        })
+def parse_json_response(response) -> dict:
+    raw_content = response.content if hasattr(response, "content") else str(response)
+    cleaned_content = raw_content.strip().strip("`")
+
+    if not cleaned_content:
+        raise ValueError("Empty response from Gemini")
+
+    match = re.search(r'\{.*\}', cleaned_content, re.DOTALL)
+    if not match:
+        raise ValueError("No valid JSON found in Gemini response")
 
-        raw_content = response.content if hasattr(response, "content") else str(response)
-        cleaned_content = raw_content.strip().strip("`")
+    return json.loads(match.group())
 
-        match = re.search(r'\{.*\}', cleaned_content, re.DOTALL)
-        if not match:
-            raise ValueError("No valid JSON found in Gemini response")
 
-        json_str = match.group()
-        parsed = json.loads(json_str)
+def _match_result(job, score: float, explanation: str):
+    # Below-threshold scores are returned too, so the pair's fingerprint can be recorded
+    return {
+        "job_id": job["id"],
+        "match_score": score,
+        "similarity": job.get("similarity"),
+        "explanation": explanation,
+        "created_at": datetime.now().isoformat()
+    }
+
+
+async def analyze_single_job(cv_text, job, stats: LLMCallStats = None):
+    try:
+        parsed = await llm_cache.ainvoke("cv_job_match", MATCH_PROMPT, llm, {
+            "cv_text": cv_text,
+            "job_detail": job['detail']
+        }, parse_json_response, stats=stats)
 
         score = float(parsed.get("score", 0))
         explanation = parsed.get("explanation", "")
-
-        if score >= 0.5:
-            save_cv_job_matches(cv_id, job["id"], cv_text, score, explanation)
-            return {
-                "job_id": job["id"],
-                "match_score": score,
-                "explanation": explanation,
-                "created_at": datetime.now().isoformat()
-            }
+        return _match_result(job, score, explanation)
 
     except Exception as e:
         logger.error(f"Error analyzing job {job['id']}: {e}")
+        if stats:
+            stats.record_failure(e)
         return None
 
 
-def analyze_cv_with_jobs(cv_text: str, cv_id: int):
-    cache_key = f"nli_analysis:cv:{cv_id}"
-    cache_key2 = f"recommend:cv:{cv_id}"
+# ========== Batched NLI Analysis ==========
+# One CV against several jobs per call: the CV text and the instructions are sent
+# once per batch instead of once per job. MATCH_BATCH_SIZE=1 keeps one call per job.
+MATCH_BATCH_SIZE = int(os.getenv("MATCH_BATCH_SIZE", "5"))
+
+MATCH_BATCH_PROMPT = PromptTemplate.from_template("""
+    You are a professional AI recruitment assistant.
+
+    Your task is to compare the following CV with each of the Job Descriptions below, and assess how well the CV matches each job.
+
+    IMPORTANT:
+    - Your evaluation must be based solely on the candidate's **skills, experiences, education, and relevant qualifications**.
+    - You must **not** consider or mention any factors related to **gender, age, race, ethnicity, religion, marital status, physical appearance, political views**,
+    or any **personally identifiable or protected attributes**.
+    - Your assessment must be **fair, lawful, and free from bias or discrimination**.
+    - Do not include any language that may violate **equal opportunity employment principles** or local/national labor laws.
+    - Assess every job independently of the others.
+
+    Return only a JSON array with exactly one object per job, in this exact format:
+    [
+      {{
+        "job_id": <the job's id>,
+        "score": <float between 0 and 1>,
+        "explanation": "<why this CV does or does not match>"
+      }}
+    ]
+
+    CV:
+    {cv_text}
 
-    if r.exists(cache_key):
-        return json.loads(r.get(cache_key))
+    Jobs:
+    {jobs}
+    """)
 
-    jobs = get_all_jobs()
+
+def format_jobs(jobs: list) -> str:
+    return "\n\n".join(f"--- Job ID: {job['id']} ---\n{job['detail']}" for job in jobs)
+
+
+def parse_json_array_response(response) -> list:
+    """
+    Items of a JSON array reply; salvages the well-formed objects when the array as a whole is broken
+    """
+    raw_content = response.content if hasattr(response, "content") else str(response)
+    cleaned_content = raw_content.strip().strip("`")
+
+    if not cleaned_content:
+        raise ValueError("Empty response from Gemini")
+
+    match = re.search(r'\[.*\]', cleaned_content, re.DOTALL)
+    if match:
+        try:
+            items = json.loads(match.group())
+            if isinstance(items, list):
+                return [item for item in items if isinstance(item, dict)]
+        except ValueError:
+            pass
+
+    items = []
+    for candidate in re.findall(r'\{[^{}]*\}', cleaned_content):
+        try:
+            items.append(json.loads(candidate))
+        except ValueError:
+            continue
+    if not items:
+        raise ValueError("No valid JSON array found in Gemini response")
+    return items
+
+
+async def analyze_job_batch(cv_text, jobs: list, stats: LLMCallStats = None):
+    """
+    Score ``jobs`` in one call, falling back to single-job calls for items missing or malformed in the reply.
+    A batch that hit the rate limit or its deadline is recorded as failed for every job, without fallback.
+
+    Returns (match result, prompt that produced it) pairs.
+    """
+    by_id = {job["id"]: job for job in jobs}
     results = []
+    try:
+        items = await llm_cache.ainvoke("cv_job_match_batch", MATCH_BATCH_PROMPT, llm, {
+            "cv_text": cv_text,
+            "jobs": format_jobs(jobs)
+        }, parse_json_array_response, stats=stats)
+
+        for item in items:
+            try:
+                job = by_id.pop(int(item["job_id"]))
+                score = float(item.get("score", 0))
+            except (KeyError, TypeError, ValueError):
+                continue  # unknown or duplicated id, or unusable score
+            if not 0.0 <= score <= 1.0:
+                by_id[job["id"]] = job
+                continue
+            results.append((_match_result(job, score, item.get("explanation", "")), MATCH_BATCH_PROMPT))
+    except Exception as e:
+        # Out of rate limit or time: one call per job would only fail the same way, slower
+        if isinstance(e, LLMDeadlineExceeded) or is_retryable(e):
+            logger.error(f"Batched analysis of jobs {list(by_id)} failed: {e}")
+            if stats:
+                for _ in by_id:
+                    stats.record_failure(e)
+            return results
+        logger.warning(f"Batched analysis of jobs {list(by_id)} failed, scoring them one by one: {e}")
+
+    if by_id:
+        fallback = await asyncio.gather(*(analyze_single_job(cv_text, job, stats) for job in by_id.values()))
+        results.extend((result, MATCH_PROMPT) for result in fallback if result)
+    return results
+
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [
-            executor.submit(analyze_single_job, cv_id, cv_text, job)
-            for job in jobs
+async def score_jobs(cv_text, jobs: list, stats: LLMCallStats, batch_size: int = None):
+    """
+    Yield (match result, prompt that produced it) pairs as they complete, ``batch_size`` jobs per Gemini call
+    """
+    async def score_single(job):
+        result = await analyze_single_job(cv_text, job, stats)
+        return [(result, MATCH_PROMPT)] if result else []
+
+    batch_size = batch_size or MATCH_BATCH_SIZE
+    if batch_size <= 1:
+        calls = [score_single(job) for job in jobs]
+    else:
+        calls = [
+            analyze_job_batch(cv_text, jobs[start:start + batch_size], stats)
+            for start in range(0, len(jobs), batch_size)
         ]
-        for future in concurrent.futures.as_completed(futures):
-            result = future.result()
-            if result:
-                results.append(result)
+
+    for future in asyncio.as_completed(calls):
+        for scored in await future:
+            yield scored
+
+
+async def analyze_cv_with_jobs(cv_text: str, cv_id: int, top_k: int = None, min_similarity: float = None,
+                               stale_while_revalidate: bool = None, batch_size: int = None, on_event=None):
+    """
+    Cached CV analysis; concurrent misses for the same CV share one Gemini fan-out.
+
+    ``on_event`` is an optional async callback receiving progress while this caller
+    runs the analysis itself: one "plan" event, then "match" and "progress" events as
+    pairs complete. Answers served from the cache emit nothing.
+
+    The cache is keyed by CV only and holds default-settings analyses: a run with
+    ``top_k``, ``min_similarity`` or ``batch_size`` overridden bypasses it.
+    """
+    overridden = (
+        top_k not in (None, PREFILTER_TOP_K)
+        or min_similarity not in (None, PREFILTER_MIN_SIMILARITY)
+        or batch_size not in (None, MATCH_BATCH_SIZE)
+    )
+    if overridden:
+        return await _run_cv_analysis(cv_text, cv_id, top_k, min_similarity, batch_size, on_event)
+
+    return await acache_single_flight(
+        NLI_ANALYSIS,
+        lambda: _run_cv_analysis(cv_text, cv_id, top_k, min_similarity, batch_size, on_event),
+        cv_id,
+        stale_while_revalidate=stale_while_revalidate
+    )
+
+
+async def _run_cv_analysis(cv_text: str, cv_id: int, top_k: int = None, min_similarity: float = None,
+                           batch_size: int = None, on_event=None):
+    all_jobs = await asyncio.to_thread(get_all_jobs)
+    jobs, pruned = await asyncio.to_thread(prefilter_jobs, cv_text, all_jobs, top_k, min_similarity)
+
+    # Only pairs that are new, or whose CV text, job detail or prompt changed, go to Gemini.
+    # A pair's fingerprint records the prompt that scored it, single-job or batched.
+    cv_hash = content_hash(cv_text)
+    job_hashes = {job["id"]: content_hash(job["detail"]) for job in jobs}
+    versions = [prompt_version(MATCH_PROMPT), prompt_version(MATCH_BATCH_PROMPT)]
+    stored_fingerprints = await asyncio.to_thread(get_pair_fingerprints, cv_id)
+    unchanged = {
+        job_id: stored_fingerprints[job_id][1]
+        for job_id, job_hash in job_hashes.items()
+        if job_id in stored_fingerprints
+        and stored_fingerprints[job_id][0] in {fingerprint(cv_hash, job_hash, version) for version in versions}
+    }
+    stored_matches = await asyncio.to_thread(
+        get_stored_matches, cv_id, [job_id for job_id, score in unchanged.items() if score >= 0.5]
+    )
+
+    results = []
+    to_score = []
+    for job in jobs:
+        score = unchanged.get(job["id"])
+        if score is None or (score >= 0.5 and job["id"] not in stored_matches):
+            to_score.append(job)
+        elif score >= 0.5:
+            stored_score, explanation = stored_matches[job["id"]]
+            results.append({
+                "job_id": job["id"],
+                "match_score": stored_score,
+                "similarity": job.get("similarity"),
+                "explanation": explanation,
+                "created_at": datetime.now().isoformat()
+            })
+
+    if on_event:
+        await on_event({
+            "event": "plan",
+            "total_jobs": len(all_jobs),
+            "analyzed_jobs": len(jobs),
+            "pruned_jobs": pruned,
+            "scored_pairs": len(to_score),
+            "reused_pairs": len(jobs) - len(to_score)
+        })
+        for result in results:
+            await on_event({"event": "match", "match": result})
+
+    scored = []
+    new_matches = []
+    stats = LLMCallStats()
+    started = time.perf_counter()
+    # Prompts get the canonical, token-budgeted texts; hashes and storage keep the raw ones
+    prompt_cv = await canonicalize(cv_text, CV_TOKEN_BUDGET)
+    details = await canonicalize_many([job["detail"] for job in to_score], JOB_TOKEN_BUDGET)
+    prompt_jobs = [{**job, "detail": detail} for job, detail in zip(to_score, details)]
+    async for result, prompt in score_jobs(prompt_cv, prompt_jobs, stats, batch_size):
+        pair_fingerprint = fingerprint(cv_hash, job_hashes[result["job_id"]], prompt_version(prompt))
+        scored.append((result["job_id"], pair_fingerprint, result["match_score"]))
+        if result["match_score"] >= 0.5:
+            results.append(result)
+            new_matches.append((result["job_id"], result["match_score"], result["explanation"]))
+            if on_event:
+                await on_event({"event": "match", "match": result})
+        if on_event:
+            await on_event({"event": "progress", "scored": len(scored), "to_score": len(to_score)})
+    scoring_seconds = time.perf_counter() - started
 
     sorted_results = sorted(results, key=lambda x: x["match_score"], reverse=True)
 
-    save_nli_analysis(cv_id, sorted_results)
-    r.set(cache_key, json.dumps(sorted_results), ex=1800)  # Cache 30 minutes
-    r.set(cache_key2, json.dumps(sorted_results), ex=1800) # Cache 30 minutes
-    return sorted_results
+    analysis = {
+        "cv_id": cv_id,
+        "total_jobs": len(all_jobs),
+        "analyzed_jobs": len(jobs),
+        "pruned_jobs": pruned,
+        "scored_pairs": len(to_score),
+        "reused_pairs": len(jobs) - len(to_score),
+        # Failed and dropped pairs have no fingerprint yet, so the next analysis retries them
+        "failed_pairs": stats.failed,
+        "dropped_pairs": stats.dropped,
+        "retried_pairs": stats.retried,
+        # Gemini cost of this run, comparable between batch sizes
+        "llm_usage": {
+            "batch_size": max(1, batch_size or MATCH_BATCH_SIZE),
+            "requests": stats.requests,
+            "input_tokens": stats.input_tokens,
+            "output_tokens": stats.output_tokens,
+            "llm_seconds": round(stats.llm_seconds, 3),
+            "scoring_seconds": round(scoring_seconds, 3)
+        },
+        "matches": sorted_results
+    }
+
+    # recommend:cv keeps its own top-10 shape; save_analysis_results invalidated it
+    await asyncio.to_thread(save_analysis_results, cv_id, cv_text, new_matches, sorted_results, scored)
+    return analysis
 
 
 # ========== Candidate Filtering ==========
 
+# Batched filtering sends the filters and instructions once for several CVs, packing
+# CVs until the approximate prompt size reaches FILTER_BATCH_TOKEN_BUDGET
+FILTER_BATCHED = os.getenv("FILTER_BATCHED", "true").lower() == "true"
+FILTER_BATCH_TOKEN_BUDGET = int(os.getenv("FILTER_BATCH_TOKEN_BUDGET", "24000"))
+FILTER_BATCH_MAX_CVS = int(os.getenv("FILTER_BATCH_MAX_CVS", "20"))  # bounds the reply size too
+
+
 class FilterRequest(BaseModel):
     filters: dict
+    max_results: Optional[int] = None  # stop once this many candidates pass the threshold
+    deadline_seconds: Optional[float] = None  # return what has been scored when this passes
+    batched: Optional[bool] = None  # several CVs per Gemini call, defaults to FILTER_BATCHED
 
 
-def filter_candidates(req: FilterRequest):
-    rows = get_cv_for_filter()
-    filters_str = json.dumps(req.filters, ensure_ascii=False, indent=2)
-
-    candidate_filter_prompt = PromptTemplate.from_template("""
+FILTER_PROMPT = PromptTemplate.from_template("""
     You are an AI recruitment assistant. Below are the filtering criteria provided by the recruiter:
 
     {filters}
@@ -185,55 +438,195 @@ def filter_candidates(req: FilterRequest):
     Be accurate. If the CV lacks key information or doesn't match the criteria, give a low score and clearly explain why.
     """)
 
-    chain = candidate_filter_prompt | llm
 
-    best_scores = {}  # key = cv_id
+FILTER_BATCH_PROMPT = PromptTemplate.from_template("""
+    You are an AI recruitment assistant. Below are the filtering criteria provided by the recruiter:
 
-    for cv_id, cv_text in rows:
-        try:
-            response = chain.invoke({"filters": filters_str, "cv_text": cv_text})
-            response_text = response.content if hasattr(response, "content") else str(response)
-            response_text = response_text.strip().strip("`")
+    {filters}
 
-            if not response_text:
-                raise ValueError("Empty response from Gemini")
+    Here are the CV contents of several candidates, each introduced by its candidate id:
+
+    {cvs}
+
+    Your task:
+    - Evaluate how well each CV matches the filtering criteria, independently of the other CVs.
+    - Your evaluation must be based **only on relevant skills, experiences, education, certifications, and job-related qualifications**.
+    - You must **NOT** consider or mention any information related to **gender, age, race, ethnicity, religion, political belief, marital status,
+    or any other protected personal attributes**.
+    - Do **not** make assumptions if data is missing — just indicate it as insufficient information.
+    - Your response must be objective, fair, and in compliance with anti-discrimination and labor laws.
+
+    Return only a JSON array with exactly one object per candidate, in the following format:
+    [
+      {{
+        "cv_id": <the candidate id>,
+        "match_score": 0.xx,
+        "reason": "Short explanation why this CV is or is not a good match."
+      }}
+    ]
+
+    The match_score is a float value between 0 and 1.
+
+    Be accurate. If a CV lacks key information or doesn't match the criteria, give a low score and clearly explain why.
+    """)
 
-            match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if not match:
-                raise ValueError("No valid JSON found in Gemini response")
 
-            json_str = match.group()
-            parsed = json.loads(json_str)
+def format_cvs(rows: list) -> str:
+    return "\n\n".join(f"--- Candidate ID: {cv_ids[0]} ---\n{cv_text}" for _, cv_text, cv_ids in rows)
+
+
+def pack_filter_batches(rows: list, filters_str: str, budget: int = None, max_cvs: int = None):
+    """
+    Group (hash, text, cv_ids) rows into batches whose prompt stays under ``budget`` tokens
+    """
+    budget = budget or FILTER_BATCH_TOKEN_BUDGET
+    max_cvs = max_cvs or FILTER_BATCH_MAX_CVS
+    available = budget - count_tokens(FILTER_BATCH_PROMPT.template) - count_tokens(filters_str)
+
+    batches = []
+    batch, used = [], 0
+    for row in rows:
+        size = count_tokens(row[1]) + 16  # the candidate header
+        if batch and (used + size > available or len(batch) >= max_cvs):
+            batches.append(batch)
+            batch, used = [], 0
+        # A CV over the budget on its own still gets a batch of one
+        batch.append(row)
+        used += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def filter_candidates(req: FilterRequest):
+    # One row per distinct CV text, so identical texts under different ids are scored once
+    rows = await asyncio.to_thread(get_cv_for_filter)
+    texts = await canonicalize_many([cv_text for _, cv_text, _ in rows], CV_TOKEN_BUDGET)
+    rows = [(text_hash, text, cv_ids) for (text_hash, _, cv_ids), text in zip(rows, texts)]
+    filters_str = json.dumps(req.filters, ensure_ascii=False, indent=2)
+    deadline = time.monotonic() + req.deadline_seconds if req.deadline_seconds else None
+    stats = LLMCallStats()
+
+    async def evaluate_candidate(cv_ids, cv_text):
+        try:
+            parsed = await llm_cache.ainvoke(
+                "candidate_filter", FILTER_PROMPT, llm,
+                {"filters": filters_str, "cv_text": cv_text},
+                parse_json_response, deadline=deadline, stats=stats
+            )
             match_score = parsed.get("match_score", 0)
             reason = parsed.get("reason", "")
 
             if match_score >= 0.6:
-                if cv_id not in best_scores or match_score > best_scores[cv_id]["match_score"]:
-                    best_scores[cv_id] = {
+                return [
+                    {
                         "cv_id": cv_id,
                         "match_score": match_score,
                         "reason": reason
                     }
+                    for cv_id in cv_ids
+                ]
 
         except Exception as e:
-            logger.error(f"Error while processing CV {cv_id}: {e}")
+            logger.error(f"Error while processing CV {', '.join(map(str, cv_ids))}: {e}")
+            stats.record_failure(e)
+        return []
+
+    async def evaluate_single(row):
+        _, cv_text, cv_ids = row
+        return 1, await evaluate_candidate(cv_ids, cv_text)
+
+    async def evaluate_batch(batch):
+        """
+        Score a batch in one call; CVs missing or malformed in the reply are scored one by one.
+        A batch that hit the rate limit or its deadline is recorded as failed for every CV, without fallback.
+        """
+        by_key = {cv_ids[0]: (cv_ids, cv_text) for _, cv_text, cv_ids in batch}
+        results = []
+        try:
+            items = await llm_cache.ainvoke(
+                "candidate_filter_batch", FILTER_BATCH_PROMPT, llm,
+                {"filters": filters_str, "cvs": format_cvs(batch)},
+                parse_json_array_response, deadline=deadline, stats=stats
+            )
+            for item in items:
+                try:
+                    key = int(item["cv_id"])
+                    cv_ids, cv_text = by_key.pop(key)
+                    match_score = float(item.get("match_score", 0))
+                except (KeyError, TypeError, ValueError):
+                    continue  # unknown or duplicated id, or unusable score
+                if not 0.0 <= match_score <= 1.0:
+                    by_key[key] = (cv_ids, cv_text)
+                    continue
+                if match_score >= 0.6:
+                    results.extend(
+                        {"cv_id": cv_id, "match_score": match_score, "reason": item.get("reason", "")}
+                        for cv_id in cv_ids
+                    )
+        except Exception as e:
+            # Out of rate limit or time: one call per CV would only fail the same way, slower
+            if isinstance(e, LLMDeadlineExceeded) or is_retryable(e):
+                logger.error(f"Batched filtering of CVs {list(by_key)} failed: {e}")
+                for _ in by_key:
+                    stats.record_failure(e)
+                return len(batch), results
+            logger.warning(f"Batched filtering of CVs {list(by_key)} failed, scoring them one by one: {e}")
+
+        if by_key:
+            fallback = await asyncio.gather(*(
+                evaluate_candidate(cv_ids, cv_text) for cv_ids, cv_text in by_key.values()
+            ))
+            for candidate_results in fallback:
+                results.extend(candidate_results)
+        return len(batch), results
+
+    batched = FILTER_BATCHED if req.batched is None else req.batched
+    if batched:
+        batches = await asyncio.to_thread(pack_filter_batches, rows, filters_str)
+        tasks = [asyncio.create_task(evaluate_batch(batch)) for batch in batches]
+    else:
+        tasks = [asyncio.create_task(evaluate_single(row)) for row in rows]
+
+    best_scores = {}  # key = cv_id
+    evaluated = 0
+    partial = False
+
+    try:
+        for future in asyncio.as_completed(tasks, timeout=req.deadline_seconds):
+            count, results = await future
+            evaluated += count
+            for result in results:
+                best_scores[result["cv_id"]] = result
+
+            if req.max_results and len(best_scores) >= req.max_results:
+                partial = evaluated < len(rows)
+                break
+    except asyncio.TimeoutError:
+        logger.warning(f"Candidate filtering hit its {req.deadline_seconds}s deadline after {evaluated} CVs")
+        partial = True
+    finally:
+        for task in tasks:
+            task.cancel()
 
     return {
-        "matched_candidates": sorted(best_scores.values(), key=lambda x: -x["match_score"])
+        "matched_candidates": sorted(best_scores.values(), key=lambda x: -x["match_score"]),
+        "partial": partial,
+        "evaluated": evaluated,
+        "total": len(rows),
+        "batches": len(tasks) if batched else None,
+        "total_cvs": sum(len(cv_ids) for _, _, cv_ids in rows),
+        "failed": stats.failed,
+        "dropped": stats.dropped,
+        "retried": stats.retried
     }
 
 
 # ========== Related Jobs ==========
 
-def related_jobs(job_id: int):
-    cache_key = f"related_jobs:{job_id}"
-    if r.exists(cache_key):
-        return json.loads(r.get(cache_key))
-
-    other_jobs, job = get_relative_jobs(job_id)
-    results = []
+RELATED_JOBS_RERANK_TOP = int(os.getenv("RELATED_JOBS_RERANK_TOP", "5"))
 
-    prompt_template = PromptTemplate.from_template("""
+RELATED_JOBS_PROMPT = PromptTemplate.from_template("""
 Compare the similarity between the following two jobs:
 
 Job 1:
@@ -248,22 +641,45 @@ Respond in JSON format:
 {{"score": 0.0, "explanation": "..."}}
 """)
 
-    chain = prompt_template | llm
-    target_text = f"Job Name: {job.name}\nJob Description: {job.detail}"
 
-    def analyze_job(other):
-        compare_text = f"Job Name: {other.name}\nJob Description: {other.detail}"
+async def related_jobs(job_id: int, rerank: bool = False, stale_while_revalidate: bool = None, on_event=None):
+    """
+    Related jobs, best first; ``on_event`` receives a "match" event per job as it is scored
+    """
+    job = await asyncio.to_thread(get_job, job_id)
+    neighbors = await asyncio.to_thread(job_neighbors.lookup, job_id, job.detail)
+
+    if not rerank:
+        return [
+            {"jobId": neighbor_id, "score": round(score, 3), "explanation": None}
+            for neighbor_id, score in neighbors
+        ]
+
+    return await acache_single_flight(
+        RELATED_JOBS,
+        lambda: _rerank_related_jobs(job, neighbors, on_event),
+        job_id,
+        stale_while_revalidate=stale_while_revalidate
+    )
+
+
+async def _rerank_related_jobs(job, neighbors, on_event=None):
+    # Only the best few precomputed neighbours are re-scored by Gemini
+    similarities = dict(neighbors[:RELATED_JOBS_RERANK_TOP])
+    other_jobs = await asyncio.to_thread(get_active_jobs_by_ids, list(similarities))
+    results = []
+    stats = LLMCallStats()
+
+    details = await canonicalize_many([job.detail] + [other.detail for other in other_jobs], JOB_TOKEN_BUDGET)
+    target_text = f"Job Name: {job.name}\nJob Description: {details[0]}"
+
+    async def analyze_job(other, detail):
+        compare_text = f"Job Name: {other.name}\nJob Description: {detail}"
         try:
-            response = chain.invoke({
+            parsed = await llm_cache.ainvoke("related_jobs", RELATED_JOBS_PROMPT, llm, {
                 "target_text": target_text,
                 "compare_text": compare_text
-            })
-            raw_content = response.content if hasattr(response, "content") else str(response)
-            cleaned_content = raw_content.strip().strip("`")
-            if cleaned_content.startswith("json"):
-                cleaned_content = cleaned_content[4:].strip()
-
-            parsed = json.loads(cleaned_content)
+            }, parse_json_response, stats=stats)
             score = float(parsed.get("score", 0))
             explanation = parsed.get("explanation", "")
 
@@ -275,20 +691,23 @@ Respond in JSON format:
                 }
         except Exception as e:
             logger.warning(f"Failed comparing with job {other.id}: {e}")
+            stats.record_failure(e)
+            # Keep the neighbour with its embedding score rather than dropping it
+            return {"jobId": other.id, "score": round(similarities[other.id], 3), "explanation": None}
         return None
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(analyze_job, job) for job in other_jobs]
-
-        for future in as_completed(futures):
-            result = future.result()
-            if result:
-                results.append(result)
-
-    results = sorted(results, key=lambda x: x["score"], reverse=True)
-    r.setex(cache_key, 10800, json.dumps(results))  # Cache 6h
-
-    return results
+    for future in asyncio.as_completed([
+        analyze_job(other, detail) for other, detail in zip(other_jobs, details[1:])
+    ]):
+        result = await future
+        if result:
+            results.append(result)
+            if on_event:
+                await on_event({"event": "match", "match": result})
+
+    if stats.failed or stats.dropped:
+        logger.warning(f"Related jobs rerank for job {job.id}: {stats.as_dict()}")
+    return sorted(results, key=lambda x: x["score"], reverse=True)
 
 
 # llm2 = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=1)
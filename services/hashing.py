@@ -0,0 +1,15 @@
+import hashlib
+
+
+def content_hash(text: str) -> str:
+    """
+    Stable SHA-256 hex digest of a text, used to key documents by content
+    """
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def fingerprint(*parts: str) -> str:
+    """
+    SHA-256 hex digest over several hashes, e.g. a (CV text, job detail) pair
+    """
+    return hashlib.sha256(":".join(parts).encode("utf-8")).hexdigest()
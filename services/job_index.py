@@ -0,0 +1,300 @@
+import os
+import json
+import uuid
+import shutil
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services.database import get_jobs_for_index
+from services.embeddings import EMBEDDING_MODEL_NAME, embed_texts, top_k_by_similarity
+from services.file_lock import file_lock
+from services.hashing import content_hash
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# === Index Configuration ===
+JOB_INDEX_DIR = os.getenv("JOB_INDEX_DIR", os.path.join("data", "job_index"))
+
+# Retrieval stage in front of the Gemini scorers: only the top-K most similar
+# jobs above the cutoff are sent to the LLM. A top-K of 0 disables the cap.
+PREFILTER_TOP_K = int(os.getenv("PREFILTER_TOP_K", "20"))
+PREFILTER_MIN_SIMILARITY = float(os.getenv("PREFILTER_MIN_SIMILARITY", "0.2"))
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = "refresh.lock"
+
+Snapshot = namedtuple("Snapshot", ["version", "ids", "hashes", "alive", "vectors", "positions"])
+
+
+def _empty_snapshot(dim: int = 0) -> Snapshot:
+    return Snapshot(
+        version=0,
+        ids=np.empty(0, dtype=np.int64),
+        hashes=np.empty(0, dtype="U64"),
+        alive=np.empty(0, dtype=bool),
+        vectors=np.empty((0, dim), dtype=np.float32),
+        positions={}
+    )
+
+
+class JobIndex:
+    """
+    Job-description embeddings keyed by job id and detail hash.
+
+    Vectors live in a memory-mapped ``.npy`` matrix next to id, hash and
+    liveness arrays. Refreshes are serialized across processes by a file lock;
+    each save writes a new, uniquely named version directory and then swaps
+    the manifest, so readers in other workers never see a half-written index.
+    Inactive or deleted jobs are tombstoned rather than removed until enough
+    of them pile up to make compaction worthwhile.
+    """
+
+    def __init__(self, directory: str = JOB_INDEX_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._snapshot = _empty_snapshot()
+
+    # === Persistence ===
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST_FILE)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def load(self, retries: int = 1):
+        manifest = self._read_manifest()
+        if not manifest:
+            return False
+        if manifest.get("model") != EMBEDDING_MODEL_NAME:
+            logger.info("Job index was built with another embedding model, it will be rebuilt")
+            return False
+        if manifest["version"] == self._snapshot.version:
+            return True
+
+        path = os.path.join(self.directory, manifest["path"])
+        try:
+            ids = np.load(os.path.join(path, "ids.npy"))
+            snapshot = Snapshot(
+                version=manifest["version"],
+                ids=ids,
+                hashes=np.load(os.path.join(path, "hashes.npy")),
+                alive=np.load(os.path.join(path, "alive.npy")),
+                vectors=np.load(os.path.join(path, "vectors.npy"), mmap_mode="r"),
+                positions={int(job_id): pos for pos, job_id in enumerate(ids)}
+            )
+        except FileNotFoundError:
+            if not retries:
+                raise
+            # Another process saved a newer version and removed this one after we read the manifest
+            return self.load(retries - 1)
+        self._snapshot = snapshot
+        logger.info(f"Loaded job index v{manifest['version']} with {int(snapshot.alive.sum())} active jobs")
+        return True
+
+    def _save(self, ids, hashes, alive, vectors):
+        """
+        Write a new version and point the manifest at it, called with the refresh file lock held
+        """
+        version = self._snapshot.version + 1
+        name = f"v{version}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(self.directory, name)
+        os.makedirs(path)
+
+        np.save(os.path.join(path, "ids.npy"), ids)
+        np.save(os.path.join(path, "hashes.npy"), hashes)
+        np.save(os.path.join(path, "alive.npy"), alive)
+        np.save(os.path.join(path, "vectors.npy"), vectors)
+
+        manifest_tmp = os.path.join(self.directory, f"{MANIFEST_FILE}.{name}.tmp")
+        with open(manifest_tmp, "w") as f:
+            json.dump({
+                "version": version,
+                "path": name,
+                "model": EMBEDDING_MODEL_NAME,
+                "count": int(ids.size),
+                "dim": int(vectors.shape[1])
+            }, f)
+        os.replace(manifest_tmp, os.path.join(self.directory, MANIFEST_FILE))
+
+        self.load()
+        self._remove_old_versions(name)
+
+    def _remove_old_versions(self, current: str):
+        for entry in os.listdir(self.directory):
+            if entry.startswith("v") and entry != current:
+                # Still memory-mapped by another worker on Windows: retry on the next save
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+    # === Incremental Refresh ===
+    def refresh(self):
+        """
+        Re-embed new or changed jobs and tombstone inactive ones, returns refresh counters
+        """
+        stats = {"added": 0, "updated": 0, "tombstoned": 0, "revived": 0}
+
+        # One refresh at a time across processes; the next one starts from the version just saved
+        with self._lock, file_lock(os.path.join(self.directory, LOCK_FILE)):
+            rows = get_jobs_for_index()
+            self.load()
+            snapshot = self._snapshot
+            hashes = snapshot.hashes.copy()
+            alive = snapshot.alive.copy()
+            seen = set()
+            pending = []  # (position or None, job id, detail hash, detail)
+
+            for row in rows:
+                job_id = row["id"]
+                seen.add(job_id)
+                pos = snapshot.positions.get(job_id)
+
+                if not row["active"]:
+                    if pos is not None and alive[pos]:
+                        alive[pos] = False
+                        stats["tombstoned"] += 1
+                    continue
+
+                detail_hash = content_hash(row["detail"])
+                if pos is not None and hashes[pos] == detail_hash:
+                    if not alive[pos]:
+                        alive[pos] = True
+                        stats["revived"] += 1
+                    continue
+
+                pending.append((pos, job_id, detail_hash, row["detail"]))
+
+            for job_id, pos in snapshot.positions.items():
+                if job_id not in seen and alive[pos]:
+                    alive[pos] = False
+                    stats["tombstoned"] += 1
+
+            if not pending and not any(stats.values()):
+                return stats
+
+            new_vectors = embed_texts([detail for _, _, _, detail in pending])
+            vectors = np.array(snapshot.vectors, dtype=np.float32)
+            if vectors.shape[0] == 0:
+                vectors = np.empty((0, new_vectors.shape[1]), dtype=np.float32)
+            ids = snapshot.ids
+
+            appended_ids, appended_hashes, appended_vectors = [], [], []
+            for (pos, job_id, detail_hash, _), vector in zip(pending, new_vectors):
+                if pos is None:
+                    appended_ids.append(job_id)
+                    appended_hashes.append(detail_hash)
+                    appended_vectors.append(vector)
+                    stats["added"] += 1
+                else:
+                    vectors[pos] = vector
+                    hashes[pos] = detail_hash
+                    alive[pos] = True
+                    stats["updated"] += 1
+
+            if appended_ids:
+                ids = np.concatenate([ids, np.array(appended_ids, dtype=np.int64)])
+                hashes = np.concatenate([hashes, np.array(appended_hashes, dtype="U64")])
+                alive = np.concatenate([alive, np.ones(len(appended_ids), dtype=bool)])
+                vectors = np.vstack([vectors, np.stack(appended_vectors)])
+
+            # Compact once tombstones make up more than half of the matrix
+            if alive.size and alive.sum() * 2 < alive.size:
+                ids, hashes, vectors, alive = ids[alive], hashes[alive], vectors[alive], alive[alive]
+
+            self._save(ids, hashes, alive, vectors)
+
+        logger.info(f"Job index refreshed: {stats}")
+        return stats
+
+    # === Lookups ===
+    def vectors_for_jobs(self, jobs: list, refresh: bool = True) -> np.ndarray:
+        """
+        Vectors aligned with ``jobs`` (dicts with ``id`` and ``detail``), refreshing the index on a miss
+        """
+        if not jobs:
+            return np.empty((0, self._snapshot.vectors.shape[1]), dtype=np.float32)
+
+        self.load()
+        snapshot = self._snapshot
+        hashes = [content_hash(job["detail"]) for job in jobs]
+        positions = [snapshot.positions.get(job["id"]) for job in jobs]
+        stale = any(
+            pos is None or not snapshot.alive[pos] or snapshot.hashes[pos] != detail_hash
+            for pos, detail_hash in zip(positions, hashes)
+        )
+
+        if stale and refresh:
+            self.refresh()
+            return self.vectors_for_jobs(jobs, refresh=False)
+        if not stale:
+            return np.asarray(snapshot.vectors[positions])
+
+        # Jobs the index still does not know about (e.g. written after the refresh read)
+        vectors = [None] * len(jobs)
+        missing = []
+        for i, (pos, detail_hash) in enumerate(zip(positions, hashes)):
+            if pos is not None and snapshot.hashes[pos] == detail_hash:
+                vectors[i] = snapshot.vectors[pos]
+            else:
+                missing.append(i)
+        for i, vector in zip(missing, embed_texts([jobs[i]["detail"] for i in missing])):
+            vectors[i] = vector
+        return np.stack(vectors).astype(np.float32, copy=False)
+
+    def active(self):
+        """
+        Ids, detail hashes and vectors of every live job in the index
+        """
+        self.load()
+        snapshot = self._snapshot
+        alive = snapshot.alive
+        return snapshot.ids[alive], snapshot.hashes[alive], np.asarray(snapshot.vectors[alive])
+
+    def is_active(self, job_ids) -> np.ndarray:
+        """
+        Whether each of ``job_ids`` is a live (not tombstoned) job of the index
+        """
+        self.load()
+        snapshot = self._snapshot
+        positions = [snapshot.positions.get(int(job_id)) for job_id in job_ids]
+        return np.array([pos is not None and bool(snapshot.alive[pos]) for pos in positions], dtype=bool)
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version,
+            "rows": int(snapshot.ids.size),
+            "active": int(snapshot.alive.sum()),
+            "tombstoned": int(snapshot.ids.size - snapshot.alive.sum())
+        }
+
+
+job_index = JobIndex()
+
+
+# === Job Pre-filter ===
+def prefilter_jobs(query_text: str, jobs: list, top_k: int = None, min_similarity: float = None):
+    """
+    Keep only the jobs whose detail is closest to the query text, returns (kept jobs, number pruned)
+    """
+    top_k = PREFILTER_TOP_K if top_k is None else top_k
+    min_similarity = PREFILTER_MIN_SIMILARITY if min_similarity is None else min_similarity
+
+    if not jobs:
+        return [], 0
+
+    query_vector = embed_texts([query_text])[0]
+    job_vectors = job_index.vectors_for_jobs(jobs)
+    indices, similarities = top_k_by_similarity(query_vector, job_vectors, top_k, min_similarity)
+
+    kept = [
+        {**jobs[i], "similarity": round(float(sim), 4)}
+        for i, sim in zip(indices, similarities)
+    ]
+    return kept, len(jobs) - len(kept)
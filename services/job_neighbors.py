@@ -0,0 +1,256 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services.cache import invalidate_related_jobs
+from services.file_lock import file_lock
+from services.embeddings import embed_texts
+from services.hashing import content_hash
+from services.job_index import JOB_INDEX_DIR, job_index
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# === Neighbour Table Configuration ===
+RELATED_JOBS_NEIGHBORS = int(os.getenv("RELATED_JOBS_NEIGHBORS", "20"))
+RELATED_JOBS_MIN_SIMILARITY = float(os.getenv("RELATED_JOBS_MIN_SIMILARITY", "0.3"))
+NEIGHBORS_CHUNK_ROWS = int(os.getenv("NEIGHBORS_CHUNK_ROWS", "2048"))
+# Seconds between background syncs, so expired jobs get tombstoned; 0 syncs once at startup
+RELATED_JOBS_SYNC_INTERVAL = float(os.getenv("RELATED_JOBS_SYNC_INTERVAL", "300"))
+
+NEIGHBORS_FILE = os.path.join(JOB_INDEX_DIR, "neighbors.npz")
+
+NeighborSnapshot = namedtuple(
+    "NeighborSnapshot", ["mtime", "ids", "hashes", "neighbor_ids", "neighbor_scores", "positions"]
+)
+
+
+def _empty_snapshot(width: int) -> NeighborSnapshot:
+    return NeighborSnapshot(
+        mtime=None,
+        ids=np.empty(0, dtype=np.int64),
+        hashes=np.empty(0, dtype="U64"),
+        neighbor_ids=np.empty((0, width), dtype=np.int64),
+        neighbor_scores=np.empty((0, width), dtype=np.float32),
+        positions={}
+    )
+
+
+def _top_neighbors(similarities: np.ndarray, width: int):
+    """
+    Best ``width`` columns of each row, best first, padded with -1 / -inf
+    """
+    rows, cols = similarities.shape
+    neighbor_ids = np.full((rows, width), -1, dtype=np.int64)
+    neighbor_scores = np.full((rows, width), -np.inf, dtype=np.float32)
+    keep = min(width, cols)
+    if keep == 0:
+        return neighbor_ids, neighbor_scores
+
+    top = np.argpartition(-similarities, keep - 1, axis=1)[:, :keep]
+    top_scores = np.take_along_axis(similarities, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    neighbor_ids[:, :keep] = np.take_along_axis(top, order, axis=1)
+    neighbor_scores[:, :keep] = np.take_along_axis(top_scores, order, axis=1)
+    return neighbor_ids, neighbor_scores
+
+
+class JobNeighborTable:
+    """
+    Sparse top-M job-to-job similarity table over the active jobs of the index.
+
+    A full build is one chunked ``V @ V.T`` over the normalized job vectors.
+    Incremental syncs only recompute the rows of added or edited jobs, plus the
+    rows whose neighbour list contains a changed job or could now admit one
+    (its column similarity beats the row's current M-th neighbour).
+    """
+
+    def __init__(self, path: str = NEIGHBORS_FILE, width: int = RELATED_JOBS_NEIGHBORS):
+        self.path = path
+        self.width = width
+        self._lock = threading.Lock()
+        # Swapped as a whole, so lookups never mix arrays of two versions
+        self._snapshot = _empty_snapshot(width)
+
+    # === Persistence ===
+    def load(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return False
+        if mtime == self._snapshot.mtime:
+            return True
+
+        with np.load(self.path) as data:
+            if data["neighbor_ids"].shape[1] != self.width:
+                logger.info("Neighbour table width changed, it will be rebuilt")
+                return False
+            self._set(mtime, data["ids"], data["hashes"], data["neighbor_ids"], data["neighbor_scores"])
+        return True
+
+    def _set(self, mtime, ids, hashes, neighbor_ids, neighbor_scores):
+        self._snapshot = NeighborSnapshot(
+            mtime=mtime,
+            ids=ids,
+            hashes=hashes,
+            neighbor_ids=neighbor_ids,
+            neighbor_scores=neighbor_scores,
+            positions={int(job_id): pos for pos, job_id in enumerate(ids)}
+        )
+
+    def _save(self, ids, hashes, neighbor_ids, neighbor_scores):
+        """
+        Replace the table file, called with the sync file lock held
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, ids=ids, hashes=hashes, neighbor_ids=neighbor_ids, neighbor_scores=neighbor_scores)
+        os.replace(tmp_path, self.path)
+        self._set(os.path.getmtime(self.path), ids, hashes, neighbor_ids, neighbor_scores)
+
+    # === Build / Sync ===
+    def build(self):
+        """
+        Recompute the whole table from the job index
+        """
+        return self.sync(full=True)
+
+    def sync(self, full: bool = False):
+        """
+        Bring the table in line with the job index, recomputing only affected rows
+        """
+        job_index.refresh()
+
+        # One sync at a time across processes, starting from the table the previous one saved
+        with self._lock, file_lock(self.path + ".lock"):
+            loaded = self.load()
+            table = self._snapshot
+            ids, hashes, vectors = job_index.active()
+            n = ids.size
+
+            previous = {} if full or not loaded else table.positions
+            changed = np.array(
+                [previous.get(int(job_id)) is None or table.hashes[previous[int(job_id)]] != job_hash
+                 for job_id, job_hash in zip(ids, hashes)],
+                dtype=bool
+            )
+            current_ids = set(ids.tolist())
+            removed = [job_id for job_id in previous if job_id not in current_ids]
+
+            if previous and not changed.any() and not removed:
+                return {"jobs": int(n), "recomputed_rows": 0}
+
+            # Carry over rows of unchanged jobs, stored as job ids so positions can shift
+            neighbor_job_ids = np.full((n, self.width), -1, dtype=np.int64)
+            neighbor_scores = np.full((n, self.width), -np.inf, dtype=np.float32)
+            for pos in np.flatnonzero(~changed):
+                old = previous[int(ids[pos])]
+                neighbor_job_ids[pos] = table.neighbor_ids[old]
+                neighbor_scores[pos] = table.neighbor_scores[old]
+
+            dirty = changed.copy()
+            stale_ids = ids[changed].tolist() + removed
+            if stale_ids:
+                dirty |= np.isin(neighbor_job_ids, stale_ids).any(axis=1)
+
+            # Column update: a changed job may now beat a row's weakest neighbour
+            changed_pos = np.flatnonzero(changed)
+            if 0 < changed_pos.size < n:
+                for start in range(0, changed_pos.size, NEIGHBORS_CHUNK_ROWS):
+                    chunk = changed_pos[start:start + NEIGHBORS_CHUNK_ROWS]
+                    column = vectors[chunk] @ vectors.T
+                    column[np.arange(chunk.size), chunk] = -np.inf
+                    dirty |= column.max(axis=0) > neighbor_scores[:, -1]
+
+            dirty_pos = np.flatnonzero(dirty)
+            for start in range(0, dirty_pos.size, NEIGHBORS_CHUNK_ROWS):
+                chunk = dirty_pos[start:start + NEIGHBORS_CHUNK_ROWS]
+                similarities = vectors[chunk] @ vectors.T
+                similarities[np.arange(chunk.size), chunk] = -np.inf
+                top, scores = _top_neighbors(similarities, self.width)
+                # A lone job only has itself as a candidate, which was masked to -inf
+                neighbor_job_ids[chunk] = np.where(np.isfinite(scores), ids[np.maximum(top, 0)], -1)
+                neighbor_scores[chunk] = scores
+
+            self._save(ids, hashes, neighbor_job_ids, neighbor_scores)
+            invalidate_related_jobs(ids[dirty_pos].tolist() + removed)
+
+        logger.info(f"Neighbour table synced: {dirty_pos.size} of {n} rows recomputed")
+        return {"jobs": int(n), "recomputed_rows": int(dirty_pos.size)}
+
+    def sync_in_background(self, interval: float = RELATED_JOBS_SYNC_INTERVAL):
+        """
+        Run ``sync()`` on a daemon thread now and every ``interval`` seconds, logging failures
+        """
+        def run():
+            while True:
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.error(f"Background neighbour table sync failed: {e}")
+                if interval <= 0:
+                    return
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="job-neighbors-sync", daemon=True)
+        thread.start()
+        return thread
+
+    # === Lookups ===
+    def lookup(self, job_id: int, detail: str = None, limit: int = None,
+               min_similarity: float = RELATED_JOBS_MIN_SIMILARITY):
+        """
+        Precomputed (job id, similarity) neighbours.
+
+        Jobs missing from the table (new, expired or disabled) or edited since the last
+        sync are embedded on the fly and compared against the active jobs instead.
+        Neighbours that are no longer active in the job index are left out.
+        """
+        self.load()
+        table = self._snapshot
+        pos = table.positions.get(job_id)
+        if pos is None or (detail is not None and table.hashes[pos] != content_hash(detail)):
+            if detail is None:
+                return []
+            neighbor_ids, neighbor_scores = self._neighbors_of_text(job_id, detail)
+        else:
+            neighbor_ids, neighbor_scores = table.neighbor_ids[pos], table.neighbor_scores[pos]
+
+        # Rows are only rewritten on sync: drop neighbours expired since then
+        active = job_index.is_active(neighbor_ids)
+        neighbors = [
+            (int(neighbor_id), float(score))
+            for neighbor_id, score, is_active in zip(neighbor_ids, neighbor_scores, active)
+            if is_active and score >= min_similarity
+        ]
+        return neighbors[:limit] if limit else neighbors
+
+    def _neighbors_of_text(self, job_id: int, detail: str):
+        """
+        Top-M (neighbour ids, scores) of a job detail against the active jobs, excluding the job itself
+        """
+        ids, _, vectors = job_index.active()
+        if ids.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        similarities = (vectors @ embed_texts([detail])[0])[None, :]
+        similarities[0, ids == job_id] = -np.inf
+        top, scores = _top_neighbors(similarities, self.width)
+        return np.where(np.isfinite(scores[0]), ids[np.maximum(top[0], 0)], -1), scores[0]
+
+
+job_neighbors = JobNeighborTable()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(job_neighbors.build())
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+
+from cachetools import LRUCache
+from dotenv import load_dotenv
+
+from services.llm_client import ainvoke
+from services.serialization import serializer
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# === LLM Cache Configuration ===
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # 7 days
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "200000"))  # Redis-wide LRU cap
+LLM_CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("LLM_CACHE_LOCAL_MAX_ENTRIES", "5000"))  # per process
+
+LLM_CACHE_PREFIX = "llm_cache"
+LLM_CACHE_LRU_INDEX = f"{LLM_CACHE_PREFIX}:lru"
+
+
+def prompt_version(prompt) -> str:
+    """
+    Short hash of a prompt template, so editing the template moves its entries to new keys
+    """
+    return hashlib.sha256(prompt.template.encode("utf-8")).hexdigest()[:12]
+
+
+def model_name(llm) -> str:
+    return getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+
+
+class LLMResponseCache:
+    """
+    Content-addressed cache of parsed LLM responses, backed by an async Redis client.
+
+    Keys hash the model name, the prompt template version and the prompt
+    inputs. Values are the parsed JSON payloads, stored in Redis with a TTL
+    and fronted by a small in-process LRU. Redis usage is capped LRU-style
+    through a sorted set of last-access times that is trimmed on write.
+    """
+
+    def __init__(self, redis_client, ttl: int = LLM_CACHE_TTL, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 local_max_entries: int = LLM_CACHE_LOCAL_MAX_ENTRIES):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = LRUCache(maxsize=local_max_entries)
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: {"hits": 0, "local_hits": 0, "misses": 0, "errors": 0})
+
+    def key(self, name: str, prompt, llm, inputs: dict) -> str:
+        version = prompt_version(prompt)
+        payload = json.dumps(
+            {"model": model_name(llm), "prompt": version, "inputs": inputs},
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return f"{LLM_CACHE_PREFIX}:{name}:{version}:{digest}"
+
+    def _count(self, name: str, counter: str):
+        with self._lock:
+            self._counters[name][counter] += 1
+
+    async def get(self, name: str, key: str):
+        with self._lock:
+            value = self._local.get(key)
+        if value is not None:
+            self._count(name, "local_hits")
+            return value
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.zadd(LLM_CACHE_LRU_INDEX, {key: time.time()}, xx=True)
+                raw, _ = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"LLM cache read failed for {key}: {e}")
+            self._count(name, "errors")
+            return None
+
+        if raw is None:
+            self._count(name, "misses")
+            return None
+
+        value = serializer.loads(raw)
+        with self._lock:
+            self._local[key] = value
+        self._count(name, "hits")
+        return value
+
+    async def set(self, key: str, value):
+        with self._lock:
+            self._local[key] = value
+
+        now = time.time()
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.set(key, serializer.dumps(value), ex=self.ttl)
+                pipe.zadd(LLM_CACHE_LRU_INDEX, {key: now})
+                pipe.zremrangebyscore(LLM_CACHE_LRU_INDEX, "-inf", now - self.ttl)  # already expired
+                pipe.zcard(LLM_CACHE_LRU_INDEX)
+                size = (await pipe.execute())[-1]
+
+            if size > self.max_entries:
+                popped = await self.redis.zpopmin(LLM_CACHE_LRU_INDEX, size - self.max_entries)
+                evicted = [member for member, _ in popped]
+                if evicted:
+                    await self.redis.delete(*evicted)
+        except Exception as e:
+            logger.warning(f"LLM cache write failed for {key}: {e}")
+
+    async def ainvoke(self, name: str, prompt, llm, inputs: dict, parse, deadline: float = None, stats=None):
+        """
+        Parsed response for ``prompt | llm`` on ``inputs``, calling Gemini only on a cache miss
+        """
+        key = self.key(name, prompt, llm, inputs)
+        value = await self.get(name, key)
+        if value is not None:
+            return value
+
+        response = await ainvoke(prompt | llm, inputs, deadline=deadline, stats=stats)
+        value = parse(response)
+        await self.set(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+            local_entries = len(self._local)
+        for values in counters.values():
+            lookups = values["hits"] + values["local_hits"] + values["misses"]
+            values["hit_ratio"] = round((values["hits"] + values["local_hits"]) / lookups, 4) if lookups else None
+        return {"prompts": counters, "local_entries": local_entries, "ttl": self.ttl}
@@ -0,0 +1,311 @@
+import os
+import time
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+from google.api_core import exceptions as google_exceptions
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from tenacity.stop import stop_base
+
+from services.redis_pool import async_redis_client
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# === Gemini Concurrency ===
+# Process-wide cap on in-flight Gemini requests, shared by every scoring loop
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "64"))
+
+_gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+# === Rate Limits / Retries ===
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "1000"))  # requests per minute, 0 disables
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))  # tokens per minute, 0 disables
+# redis: one bucket shared by every worker process | local: per process, each gets the full quota
+GEMINI_RATE_LIMIT_BACKEND = os.getenv("GEMINI_RATE_LIMIT_BACKEND", "redis")
+GEMINI_OUTPUT_TOKENS = int(os.getenv("GEMINI_OUTPUT_TOKENS", "300"))  # expected reply size, for the estimate
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "5"))
+GEMINI_RETRY_BASE = float(os.getenv("GEMINI_RETRY_BASE", "1"))  # seconds, doubled per retry with full jitter
+GEMINI_RETRY_MAX_WAIT = float(os.getenv("GEMINI_RETRY_MAX_WAIT", "30"))
+GEMINI_REQUEST_TIMEOUT = float(os.getenv("GEMINI_REQUEST_TIMEOUT", "120"))  # default per-request deadline
+
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """
+    The request could not be completed before its deadline and was dropped
+    """
+
+
+class LLMCallStats:
+    """
+    Outcome counters for one batch of Gemini calls (or the whole process)
+    """
+
+    def __init__(self):
+        self.requests = 0  # calls that reached the scheduler (cache hits never do)
+        self.retries = 0  # retry attempts
+        self.retried = 0  # calls that needed at least one retry
+        self.failed = 0  # errors and unusable responses
+        self.dropped = 0  # abandoned at the deadline
+        self.input_tokens = 0  # as reported by Gemini
+        self.output_tokens = 0
+        self.llm_seconds = 0.0  # summed latency of the Gemini calls themselves
+
+    def record_failure(self, error: Exception):
+        if isinstance(error, LLMDeadlineExceeded):
+            self.dropped += 1
+        else:
+            self.failed += 1
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "retried": self.retried,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "llm_seconds": round(self.llm_seconds, 3)
+        }
+
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously up to ``per_minute``; waiters are served in order
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def _take(self, amount: float) -> float:
+        """
+        Take ``amount`` tokens if available, returns 0 or the seconds until they will be
+        """
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    async def acquire(self, amount: float, deadline: float):
+        amount = min(amount, self.capacity)
+        try:
+            await asyncio.wait_for(self._lock.acquire(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise LLMDeadlineExceeded("Deadline passed while queued for the Gemini rate limit")
+        try:
+            while True:
+                wait = await self._take(amount)
+                if not wait:
+                    return
+                if time.monotonic() + wait > deadline:
+                    raise LLMDeadlineExceeded("Gemini rate limit would delay the request past its deadline")
+                await asyncio.sleep(wait)
+        finally:
+            self._lock.release()
+
+    async def adjust(self, amount: float):
+        """
+        Settle the difference between the estimated and the actual usage
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    async def stats(self):
+        self._refill()
+        return {"per_minute": self.capacity, "available": round(self.tokens, 1)}
+
+
+# Refill and take in one round trip on the Redis clock, so every worker process draws
+# from the same bucket. ARGV[4] = "1" settles usage even below zero (``adjust``).
+# Returns {seconds to wait, tokens left} as strings: Lua numbers are truncated to integers.
+_TAKE_TOKENS = """
+local capacity, rate, amount = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call("time")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call("hmget", KEYS[1], "tokens", "updated")
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if ARGV[4] == "1" or tokens >= amount then
+    tokens = math.min(capacity, tokens - amount)
+else
+    wait = (amount - tokens) / rate
+end
+redis.call("hset", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("expire", KEYS[1], 120)
+return {tostring(wait), tostring(tokens)}
+"""
+_take_tokens = async_redis_client.register_script(_TAKE_TOKENS)
+
+
+class RedisTokenBucket(TokenBucket):
+    """
+    Token bucket kept in Redis under ``key`` and shared by every worker process.
+
+    Waiters of one process are still served in order; across processes the first
+    to find enough tokens wins.
+    """
+
+    def __init__(self, key: str, per_minute: int):
+        super().__init__(per_minute)
+        self.key = key
+
+    async def _call(self, amount: float, settle: bool = False):
+        wait, tokens = await _take_tokens(
+            keys=[self.key], args=[self.capacity, self.rate, amount, "1" if settle else "0"]
+        )
+        return float(wait), float(tokens)
+
+    async def _take(self, amount: float) -> float:
+        wait, _ = await self._call(amount)
+        return wait
+
+    async def adjust(self, amount: float):
+        await self._call(amount, settle=True)
+
+    async def stats(self):
+        _, tokens = await self._call(0)
+        return {"per_minute": self.capacity, "available": round(tokens, 1), "shared": True}
+
+
+def get_bucket(name: str, per_minute: int, backend: str = GEMINI_RATE_LIMIT_BACKEND):
+    if not per_minute:
+        return None
+    if backend == "local":
+        return TokenBucket(per_minute)
+    if backend == "redis":
+        return RedisTokenBucket(f"gemini_rate:{name}", per_minute)
+    raise ValueError(f"Unknown GEMINI_RATE_LIMIT_BACKEND {backend!r}, expected 'redis' or 'local'")
+
+
+_request_bucket = get_bucket("requests", GEMINI_RPM)
+_token_bucket = get_bucket("tokens", GEMINI_TPM)
+
+# Process-wide totals, exposed by scheduler_stats()
+_totals = LLMCallStats()
+
+
+class _stop_at_deadline(stop_base):
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+
+    def __call__(self, retry_state) -> bool:
+        return time.monotonic() + (retry_state.upcoming_sleep or 0) >= self.deadline
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    # langchain-google-genai re-wraps some API errors, keeping the status in the message
+    message = str(error)
+    return "429" in message or "Resource has been exhausted" in message or "503" in message
+
+
+def estimate_tokens(chain, inputs: dict) -> int:
+    template = getattr(getattr(chain, "first", None), "template", "")
+    chars = len(template) + sum(len(str(value)) for value in inputs.values())
+    return chars // 4 + GEMINI_OUTPUT_TOKENS
+
+
+async def _invoke_once(chain, inputs: dict, estimate: int, deadline: float, counters: list):
+    if _request_bucket:
+        await _request_bucket.acquire(1, deadline)
+    if _token_bucket:
+        await _token_bucket.acquire(estimate, deadline)
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise LLMDeadlineExceeded("Deadline passed before the Gemini request was sent")
+    async with _gemini_semaphore:
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(chain.ainvoke(inputs), deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            raise LLMDeadlineExceeded("Gemini did not answer before the deadline")
+        finally:
+            for counter in counters:
+                counter.llm_seconds += time.perf_counter() - started
+
+    usage = getattr(response, "usage_metadata", None) or {}
+    for counter in counters:
+        counter.input_tokens += usage.get("input_tokens", 0)
+        counter.output_tokens += usage.get("output_tokens", 0)
+    if _token_bucket and usage.get("total_tokens"):
+        await _token_bucket.adjust(usage["total_tokens"] - estimate)
+    return response
+
+
+async def ainvoke(chain, inputs: dict, deadline: float = None, stats: LLMCallStats = None):
+    """
+    Run ``chain.ainvoke`` within the Gemini rate limits, retrying 429s and transient errors.
+
+    ``deadline`` is a ``time.monotonic()`` timestamp (default: GEMINI_REQUEST_TIMEOUT from
+    now); a request that cannot finish by then raises LLMDeadlineExceeded.
+    """
+    default_deadline = time.monotonic() + GEMINI_REQUEST_TIMEOUT
+    deadline = min(deadline, default_deadline) if deadline else default_deadline
+    counters = [_totals] + ([stats] if stats else [])
+    for counter in counters:
+        counter.requests += 1
+
+    def before_sleep(retry_state):
+        error = retry_state.outcome.exception()
+        logger.warning(f"Gemini call failed ({error}), retry {retry_state.attempt_number} "
+                       f"in {retry_state.upcoming_sleep:.1f}s")
+        for counter in counters:
+            counter.retries += 1
+            if retry_state.attempt_number == 1:
+                counter.retried += 1
+
+    estimate = estimate_tokens(chain, inputs)
+    retrying = AsyncRetrying(
+        retry=retry_if_exception(is_retryable),
+        wait=wait_random_exponential(multiplier=GEMINI_RETRY_BASE, max=GEMINI_RETRY_MAX_WAIT),
+        stop=stop_after_attempt(GEMINI_MAX_ATTEMPTS) | _stop_at_deadline(deadline),
+        before_sleep=before_sleep,
+        reraise=True
+    )
+    try:
+        async for attempt in retrying:
+            with attempt:
+                return await _invoke_once(chain, inputs, estimate, deadline, counters)
+    except Exception as e:
+        # A retryable error that stopped before the last attempt ran out of time
+        if is_retryable(e) and retrying.statistics.get("attempt_number", 0) < GEMINI_MAX_ATTEMPTS:
+            dropped = LLMDeadlineExceeded(f"Gemini retries ran out of time: {e}")
+            _totals.record_failure(dropped)
+            raise dropped from e
+        _totals.record_failure(e)
+        raise
+
+
+async def scheduler_stats():
+    return {
+        "totals": _totals.as_dict(),
+        "requests_per_minute": await _request_bucket.stats() if _request_bucket else None,
+        "tokens_per_minute": await _token_bucket.stats() if _token_bucket else None,
+        "max_concurrency": GEMINI_MAX_CONCURRENCY
+    }
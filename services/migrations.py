@@ -0,0 +1,204 @@
+import re
+import sys
+import logging
+from collections import namedtuple
+
+from services.database import connect
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for pg_advisory_lock, so only one worker migrates at a time
+MIGRATION_LOCK_KEY = 7318540021
+
+Migration = namedtuple("Migration", ["version", "description", "statements", "transactional"])
+
+_CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE
+)
+
+# Hot-path indexes for recommend_jobs_for_cv / recommend_cvs_for_job:
+#   WHERE cv_id = ? ORDER BY match_score DESC LIMIT 10 (and the job_id equivalent)
+MATCH_INDEX_STATEMENTS = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS cv_job_matches_cv_id_score_idx "
+    "ON cv_job_matches (cv_id, match_score DESC)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS cv_job_matches_job_id_score_idx "
+    "ON cv_job_matches (job_id, match_score DESC)",
+]
+
+MIGRATIONS = [
+    Migration("0001", "create cv_job_matches and nli_analysis", [
+        """
+        CREATE TABLE IF NOT EXISTS cv_job_matches (
+            id SERIAL PRIMARY KEY,
+            cv_id INTEGER NOT NULL,
+            job_id INTEGER NOT NULL,
+            cv_text TEXT,
+            match_score REAL NOT NULL,
+            explanation TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS nli_analysis (
+            id SERIAL PRIMARY KEY,
+            cv_id INTEGER NOT NULL,
+            analysis JSONB NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+        """,
+    ], True),
+    Migration("0002", "create cv_job_fingerprints", [
+        """
+        CREATE TABLE IF NOT EXISTS cv_job_fingerprints (
+            cv_id INTEGER NOT NULL,
+            job_id INTEGER NOT NULL,
+            fingerprint CHAR(64) NOT NULL,
+            match_score REAL NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (cv_id, job_id)
+        )
+        """,
+    ], True),
+    # Upserts need one row per pair: drop historical duplicates, then enforce it
+    Migration("0003", "unique (cv_id, job_id) on cv_job_matches", [
+        """
+        DELETE FROM cv_job_matches a
+        USING cv_job_matches b
+        WHERE a.cv_id = b.cv_id AND a.job_id = b.job_id AND a.ctid < b.ctid
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS cv_job_matches_cv_id_job_id_key ON cv_job_matches (cv_id, job_id)",
+    ], True),
+    # CONCURRENTLY keeps writes flowing on large tables but cannot run inside a transaction.
+    # A failed concurrent build leaves an INVALID index behind, dropped by migrate() before the rerun.
+    Migration("0004", "composite (cv_id|job_id, match_score DESC) indexes", MATCH_INDEX_STATEMENTS, False),
+    # CV texts were repeated on every match row: keep one copy per CV, keyed by content hash
+    Migration("0005", "move cv_text from cv_job_matches to cv_documents", [
+        """
+        CREATE TABLE IF NOT EXISTS cv_documents (
+            cv_id INTEGER PRIMARY KEY,
+            content_hash CHAR(64) NOT NULL,
+            cv_text TEXT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS cv_documents_content_hash_idx ON cv_documents (content_hash)",
+        # Backfill from the most recently written match row of each CV
+        """
+        INSERT INTO cv_documents (cv_id, content_hash, cv_text)
+        SELECT DISTINCT ON (cv_id) cv_id, encode(sha256(convert_to(cv_text, 'UTF8')), 'hex'), cv_text
+        FROM cv_job_matches
+        WHERE cv_text IS NOT NULL
+        ORDER BY cv_id, ctid DESC
+        ON CONFLICT (cv_id) DO NOTHING
+        """,
+        # NOT VALID: enforced for new rows without failing on historical rows that had no text
+        """
+        ALTER TABLE cv_job_matches
+        ADD CONSTRAINT cv_job_matches_cv_id_fkey
+        FOREIGN KEY (cv_id) REFERENCES cv_documents (cv_id) NOT VALID
+        """,
+        "ALTER TABLE cv_job_matches DROP COLUMN IF EXISTS cv_text",
+    ], True),
+]
+
+
+def _ensure_migrations_table(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+        """
+    )
+
+
+def _drop_invalid_index(cur, name: str):
+    """
+    Drop index ``name`` if an interrupted concurrent build left it INVALID, IF NOT EXISTS would keep it
+    """
+    cur.execute(
+        """
+        SELECT n.nspname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = %s AND n.nspname = current_schema() AND NOT i.indisvalid
+        """,
+        (name,)
+    )
+    row = cur.fetchone()
+    if row:
+        logger.warning(f"Dropping invalid index {name} left by an interrupted build")
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{row[0]}"."{name}"')
+
+
+def applied_versions(cur):
+    _ensure_migrations_table(cur)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrate():
+    """
+    Apply pending migrations in order, returns the versions applied
+    """
+    conn = connect()
+    conn.autocommit = True
+    cur = conn.cursor()
+    applied = []
+    try:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        done = applied_versions(cur)
+
+        for migration in MIGRATIONS:
+            if migration.version in done:
+                continue
+            logger.info(f"Applying migration {migration.version}: {migration.description}")
+
+            if migration.transactional:
+                cur.execute("BEGIN")
+                try:
+                    for statement in migration.statements:
+                        cur.execute(statement)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                        (migration.version, migration.description)
+                    )
+                    cur.execute("COMMIT")
+                except Exception:
+                    cur.execute("ROLLBACK")
+                    raise
+            else:
+                # Each statement is idempotent (IF NOT EXISTS), so a rerun after a failure is safe
+                for statement in migration.statements:
+                    index = _CONCURRENT_INDEX.search(statement)
+                    if index:
+                        _drop_invalid_index(cur, index.group(1))
+                    cur.execute(statement)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (migration.version, migration.description)
+                )
+            applied.append(migration.version)
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+        cur.close()
+        conn.close()
+    return applied
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if "--list" in sys.argv:
+        conn = connect()
+        cur = conn.cursor()
+        done = applied_versions(cur)
+        conn.commit()
+        conn.close()
+        for migration in MIGRATIONS:
+            status = "applied" if migration.version in done else "pending"
+            print(f"{migration.version}  {status:8}  {migration.description}")
+    else:
+        print(f"Applied: {migrate() or 'nothing to do'}")
@@ -0,0 +1,157 @@
+import os
+import re
+import html
+import asyncio
+import logging
+import threading
+import unicodedata
+
+from cachetools import LRUCache
+from dotenv import load_dotenv
+
+from services.cache import CANONICAL_TEXT, acache_mget, acache_set_many
+from services.hashing import content_hash
+from services.tokens import count_tokens, get_encoding
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# === Preprocessing Configuration ===
+CV_TOKEN_BUDGET = int(os.getenv("CV_TOKEN_BUDGET", "3000"))
+JOB_TOKEN_BUDGET = int(os.getenv("JOB_TOKEN_BUDGET", "1500"))
+CANONICAL_LOCAL_MAX_ENTRIES = int(os.getenv("CANONICAL_LOCAL_MAX_ENTRIES", "5000"))  # per process
+
+# Share of an over-budget document kept from its start; the rest comes from its end
+HEAD_SHARE = 0.75
+TRUNCATION_MARKER = "\n[...]\n"
+
+_TAG = re.compile(r"<[^>]+>")
+# Markup worth stripping: common elements, comments or doctypes, not "<3 years in Go>"
+_HTML_ELEMENTS = re.compile(
+    r"</?(html|body|head|div|span|p|br|hr|ul|ol|li|table|tr|td|th|h[1-6]|strong|b|i|em|u|a|font|section)\b",
+    re.IGNORECASE
+)
+_SPACES = re.compile(r"[ \t\f\v]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+# Lines that carry no signal for matching: page furniture, apply/contact calls to action,
+# equal-opportunity statements (the prompts already require unbiased assessment)
+_BOILERPLATE = re.compile(
+    r"^\s*("
+    r"page \d+( of \d+)?"
+    r"|curriculum vitae|resume|cv"
+    r"|references (are )?available (up)?on request\.?"
+    r"|apply now!?|click here to apply.*|how to apply:?"
+    r"|.*equal opportunity employer.*"
+    r"|.*we do not discriminate.*"
+    r")\s*$",
+    re.IGNORECASE
+)
+
+_local = LRUCache(maxsize=CANONICAL_LOCAL_MAX_ENTRIES)
+_local_lock = threading.Lock()
+
+
+def is_html(text: str) -> bool:
+    """
+    Whether ``text`` contains HTML markup rather than just angle brackets
+    """
+    return bool(_HTML_ELEMENTS.search(text)) or "<!--" in text or "<!doctype" in text.lower()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Plain text with HTML (when the input is HTML), boilerplate lines, consecutive
+    duplicate lines and extra whitespace removed
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    if is_html(text):
+        text = html.unescape(_TAG.sub("\n", text))
+
+    lines = []
+    previous = None
+    for line in text.splitlines():
+        line = _SPACES.sub(" ", line).strip()
+        if line and (_BOILERPLATE.match(line) or line.lower() == previous):
+            continue
+        if line:
+            previous = line.lower()
+        lines.append(line)
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def fit_to_budget(text: str, budget: int) -> str:
+    """
+    ``text`` cut down to about ``budget`` tokens, keeping its start and its end
+    """
+    if budget <= 0 or count_tokens(text) <= budget:
+        return text
+
+    encoding = get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    head = int(budget * HEAD_SHARE)
+    tail = max(0, budget - head - count_tokens(TRUNCATION_MARKER))
+    # Cuts can land inside a multi-byte character, drop the replacement characters
+    kept = encoding.decode(tokens[:head]).rstrip("�")
+    if tail:
+        kept += TRUNCATION_MARKER + encoding.decode(tokens[-tail:]).lstrip("�")
+    return kept
+
+
+def canonical_text(text: str, budget: int) -> str:
+    return fit_to_budget(normalize_text(text), budget)
+
+
+async def canonicalize_many(texts: list, budget: int) -> list:
+    """
+    Canonical forms of ``texts``, built once per distinct document and budget.
+
+    Looked up by content hash in the process LRU, then in Redis with one MGET;
+    only documents missing from both are processed.
+    """
+    hashes = [content_hash(text or "") for text in texts]
+    found = {}
+    with _local_lock:
+        for text_hash in set(hashes):
+            value = _local.get((budget, text_hash))
+            if value is not None:
+                found[text_hash] = value
+
+    missing = [text_hash for text_hash in dict.fromkeys(hashes) if text_hash not in found]
+    if missing:
+        try:
+            cached = await acache_mget(CANONICAL_TEXT, [f"{budget}:{text_hash}" for text_hash in missing])
+        except Exception as e:
+            logger.warning(f"Canonical text cache unavailable, rebuilding {len(missing)} documents: {e}")
+            cached = {}
+
+        to_build = []
+        for text_hash in missing:
+            value = cached.get(f"{budget}:{text_hash}")
+            if value is None:
+                to_build.append(text_hash)
+            else:
+                found[text_hash] = value
+
+        if to_build:
+            texts_by_hash = dict(zip(hashes, texts))
+            outputs = await asyncio.to_thread(
+                lambda: [canonical_text(texts_by_hash[text_hash], budget) for text_hash in to_build]
+            )
+            built = dict(zip(to_build, outputs))
+            found.update(built)
+            try:
+                await acache_set_many(CANONICAL_TEXT, {f"{budget}:{h}": value for h, value in built.items()})
+            except Exception as e:
+                logger.warning(f"Failed to cache {len(built)} canonical texts: {e}")
+
+        with _local_lock:
+            for text_hash in missing:
+                _local[(budget, text_hash)] = found[text_hash]
+
+    return [found[text_hash] for text_hash in hashes]
+
+
+async def canonicalize(text: str, budget: int) -> str:
+    return (await canonicalize_many([text], budget))[0]
@@ -0,0 +1,40 @@
+import os
+
+import redis
+import redis.asyncio
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# === Redis Configuration ===
+# Sync callers run on uvicorn's AnyIO threadpool (40 threads) and on asyncio.to_thread's
+# default executor (min(32, cpu + 4) threads), so size the pool to cover both.
+WORKER_THREADS = 40 + min(32, (os.cpu_count() or 1) + 4)
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", str(WORKER_THREADS + 8)))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))  # wait for a free connection
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "2"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+
+REDIS_SETTINGS = {
+    "host": os.getenv("REDIS_HOST"),
+    "port": int(os.getenv("REDIS_PORT")),
+    "db": int(os.getenv("REDIS_DB")),
+    "socket_timeout": REDIS_SOCKET_TIMEOUT,
+    "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT,
+    "socket_keepalive": True,
+    "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+    "retry_on_timeout": True,
+    "max_connections": REDIS_MAX_CONNECTIONS,
+    "timeout": REDIS_POOL_TIMEOUT,
+}
+
+# One pool per process shared by every module; blocking pools wait for a free
+# connection instead of raising when all of them are checked out.
+redis_pool = redis.BlockingConnectionPool(**REDIS_SETTINGS)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+# For async endpoints and coroutines, so cache round trips do not block the event loop
+async_redis_pool = redis.asyncio.BlockingConnectionPool(**REDIS_SETTINGS)
+async_redis_client = redis.asyncio.Redis(connection_pool=async_redis_pool)
@@ -0,0 +1,104 @@
+import os
+import json
+import threading
+
+import orjson
+import zstandard
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# === Serializer Configuration ===
+CACHE_SERIALIZER = os.getenv("CACHE_SERIALIZER", "compact")  # compact | json
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+CACHE_ZSTD_LEVEL = int(os.getenv("CACHE_ZSTD_LEVEL", "3"))
+
+# === Compact Format ===
+# A 2-byte header, then the body: b"\x00" (never the first byte of JSON text) and a
+# codec byte. Anything without the header is read as plain JSON, so values written
+# before the header existed stay readable. Every serializer reads both formats;
+# CACHE_SERIALIZER only picks the one written, so it can be switched on a live cache.
+HEADER_MAGIC = 0x00
+CODEC_ORJSON = 0x01
+CODEC_ORJSON_ZSTD = 0x02
+
+# zstd contexts must not be shared between threads
+_local = threading.local()
+
+
+def _decompressor():
+    if not hasattr(_local, "decompressor"):
+        _local.decompressor = zstandard.ZstdDecompressor()
+    return _local.decompressor
+
+
+def decode(raw: bytes):
+    """
+    Value of a stored payload in any supported format, chosen by its header
+    """
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    if not raw or raw[0] != HEADER_MAGIC:
+        return orjson.loads(raw)  # legacy JSON text
+
+    codec = raw[1]
+    if codec == CODEC_ORJSON:
+        return orjson.loads(raw[2:])
+    if codec == CODEC_ORJSON_ZSTD:
+        return orjson.loads(_decompressor().decompress(raw[2:]))
+    raise ValueError(f"Unknown cache value codec {codec}")
+
+
+class JsonSerializer:
+    """
+    Writes plain ``json.dumps`` text, the historical format
+    """
+    name = "json"
+
+    def dumps(self, value) -> bytes:
+        return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+    def loads(self, raw: bytes):
+        return decode(raw)
+
+
+class CompactSerializer:
+    """
+    Writes orjson, zstd-compressed above ``min_bytes``, behind a format header
+    """
+    name = "compact"
+
+    def __init__(self, min_bytes: int = CACHE_COMPRESS_MIN_BYTES, level: int = CACHE_ZSTD_LEVEL):
+        self.min_bytes = min_bytes
+        self.level = level
+        # zstd contexts must not be shared between threads
+        self._local = threading.local()
+
+    def _compressor(self):
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return self._local.compressor
+
+    def dumps(self, value) -> bytes:
+        body = orjson.dumps(value)
+        if len(body) >= self.min_bytes:
+            return bytes((HEADER_MAGIC, CODEC_ORJSON_ZSTD)) + self._compressor().compress(body)
+        return bytes((HEADER_MAGIC, CODEC_ORJSON)) + body
+
+    def loads(self, raw: bytes):
+        return decode(raw)
+
+
+SERIALIZERS = {"json": JsonSerializer, "compact": CompactSerializer}
+
+
+def get_serializer(name: str = CACHE_SERIALIZER):
+    try:
+        return SERIALIZERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown CACHE_SERIALIZER {name!r}, expected one of {sorted(SERIALIZERS)}")
+
+
+# Shared by every Redis value writer and reader
+serializer = get_serializer()
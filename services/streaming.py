@@ -0,0 +1,65 @@
+import os
+import json
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# === Streaming Configuration ===
+STREAM_KEEPALIVE = float(os.getenv("STREAM_KEEPALIVE", "15"))  # seconds between SSE keep-alive comments
+
+MEDIA_TYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+
+def encode_event(event: dict, fmt: str) -> str:
+    if fmt == "sse":
+        data = {key: value for key, value in event.items() if key != "event"}
+        return f"event: {event['event']}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+    return json.dumps(event, ensure_ascii=False, default=str) + "\n"
+
+
+async def stream_events(run, summarize, fmt: str = "sse"):
+    """
+    Encoded events of ``await run(on_event)`` as they are emitted, then its summary.
+
+    ``run`` receives an async ``on_event`` callback; ``summarize`` turns its return
+    value into the final "summary" event. Failures end the stream with an "error"
+    event, and a client that disconnects cancels the run.
+    """
+    queue = asyncio.Queue()
+
+    async def on_event(event: dict):
+        await queue.put(event)
+
+    task = asyncio.create_task(run(on_event))
+    try:
+        while True:
+            getter = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({getter, task}, timeout=STREAM_KEEPALIVE,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield encode_event(getter.result(), fmt)
+                continue
+            getter.cancel()
+
+            if task not in done:
+                if fmt == "sse":
+                    yield ": keepalive\n\n"
+                continue
+
+            while not queue.empty():
+                yield encode_event(queue.get_nowait(), fmt)
+            try:
+                yield encode_event({"event": "summary", **summarize(task.result())}, fmt)
+            except Exception as e:
+                logger.error(f"Streamed run failed: {e}")
+                yield encode_event({"event": "error", "detail": str(e)}, fmt)
+            return
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,38 @@
+import os
+import logging
+import threading
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# === Token Counting ===
+# Gemini has no local tokenizer; a tiktoken encoding gives a close enough count
+# for sizing prompts against a budget.
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                import tiktoken
+                logger.info(f"Loading tokenizer {TOKEN_ENCODING}")
+                _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate token count of ``text``
+    """
+    if not text:
+        return 0
+    return len(get_encoding().encode(text, disallowed_special=()))
@@ -0,0 +1,7 @@
+import os
+
+# Set before any service module is imported: they read these at import time, and
+# nothing in the tests talks to Gemini, PostgreSQL or Redis.
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "")
+os.environ.setdefault("ANALYSIS_QUEUE_BACKEND", "local")
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+# WeasyPrint raises OSError, not ImportError, when its system libraries are missing
+try:
+    from services import analysis_queue
+    from services.analysis_queue import DONE, FAILED, QUEUED, LocalTaskBackend, execute_task
+except (ImportError, OSError) as e:
+    pytest.skip(f"Service dependencies unavailable: {e}", allow_module_level=True)
+
+REQUEST = {"cv_text": "Python developer", "cv_id": 7, "top_k": None, "min_similarity": None, "batch_size": None}
+
+
+def match(job_id: int, score: float):
+    return {"job_id": job_id, "match_score": score, "explanation": "fits"}
+
+
+def fake_analysis(matches: list, fail_after: int = None):
+    """
+    Stand-in for analyze_cv_with_jobs emitting the same events, optionally failing part way
+    """
+    async def analyze(cv_text, cv_id, top_k=None, min_similarity=None, stale_while_revalidate=None,
+                      batch_size=None, on_event=None):
+        await on_event({"event": "plan", "scored_pairs": len(matches)})
+        for scored, result in enumerate(matches, 1):
+            if fail_after is not None and scored > fail_after:
+                raise RuntimeError("Gemini unavailable")
+            await on_event({"event": "match", "match": result})
+            await on_event({"event": "progress", "scored": scored, "to_score": len(matches)})
+        return {"cv_id": cv_id, "matches": sorted(matches, key=lambda m: m["match_score"], reverse=True)}
+
+    return analyze
+
+
+def test_enqueued_task_runs_to_completion(monkeypatch):
+    matches = [match(1, 0.6), match(2, 0.9)]
+    monkeypatch.setattr(analysis_queue, "analyze_cv_with_jobs", fake_analysis(matches))
+
+    async def scenario():
+        backend = LocalTaskBackend()
+        task = await backend.enqueue(REQUEST)
+        assert task["status"] == QUEUED
+        await backend.join()
+        task_id = task["task_id"]
+        return await backend.get(task_id), await backend.partial(task_id), await backend.result(task_id)
+
+    task, partial, result = asyncio.run(scenario())
+    assert task["status"] == DONE
+    assert task["attempts"] == 1
+    assert task["to_score"] == 2 and task["scored"] == 2 and task["matches"] == 2
+    assert task["error"] is None and task["finished_at"] >= task["started_at"]
+    assert partial == matches
+    assert [m["job_id"] for m in result["matches"]] == [2, 1]
+
+
+def test_failed_task_records_the_error(monkeypatch):
+    monkeypatch.setattr(analysis_queue, "analyze_cv_with_jobs", fake_analysis([match(1, 0.6)], fail_after=0))
+
+    async def scenario():
+        backend = LocalTaskBackend()
+        task = await backend.enqueue(REQUEST)
+        await backend.join()
+        return await backend.get(task["task_id"]), await backend.result(task["task_id"])
+
+    task, result = asyncio.run(scenario())
+    assert task["status"] == FAILED
+    assert task["error"] == "Gemini unavailable"
+    assert result is None
+
+
+def test_retried_task_starts_from_clean_progress(monkeypatch):
+    matches = [match(1, 0.6), match(2, 0.9), match(3, 0.7)]
+
+    async def scenario():
+        backend = LocalTaskBackend()
+        monkeypatch.setattr(analysis_queue, "analyze_cv_with_jobs", fake_analysis(matches, fail_after=2))
+        task = await backend.enqueue(REQUEST)
+        await backend.join()
+        first = await backend.get(task["task_id"]), await backend.partial(task["task_id"])
+
+        monkeypatch.setattr(analysis_queue, "analyze_cv_with_jobs", fake_analysis(matches))
+        await execute_task(backend, task["task_id"])
+        second = await backend.get(task["task_id"]), await backend.partial(task["task_id"])
+        return first, second
+
+    (failed, failed_partial), (done, partial) = asyncio.run(scenario())
+    assert failed["status"] == FAILED and failed["matches"] == 2 and len(failed_partial) == 2
+    assert done["status"] == DONE and done["attempts"] == 2 and done["error"] is None
+    assert done["matches"] == 3 and done["scored"] == 3
+    assert partial == matches
+
+
+def test_concurrency_is_bounded(monkeypatch):
+    running = {"now": 0, "peak": 0}
+
+    async def analyze(cv_text, cv_id, top_k=None, min_similarity=None, stale_while_revalidate=None,
+                      batch_size=None, on_event=None):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+        return {"cv_id": cv_id, "matches": []}
+
+    monkeypatch.setattr(analysis_queue, "analyze_cv_with_jobs", analyze)
+
+    async def scenario():
+        backend = LocalTaskBackend(concurrency=2)
+        tasks = [await backend.enqueue({**REQUEST, "cv_id": cv_id}) for cv_id in range(6)]
+        await backend.join()
+        return [await backend.get(task["task_id"]) for task in tasks]
+
+    tasks = asyncio.run(scenario())
+    assert all(task["status"] == DONE for task in tasks)
+    assert running["peak"] == 2
+
+
+def test_stale_tasks_are_reaped_while_every_slot_is_busy(monkeypatch):
+    backend = analysis_queue.RedisTaskBackend()
+    reaped = []
+
+    async def busy():
+        await asyncio.Event().wait()  # a consumer stuck on a long analysis
+
+    async def requeue_stale():
+        reaped.append(True)
+
+    monkeypatch.setattr(analysis_queue, "ANALYSIS_TASK_REAP_INTERVAL", 0.01)
+    monkeypatch.setattr(backend, "_consume", busy)
+    monkeypatch.setattr(backend, "_requeue_stale", requeue_stale)
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(backend.run_worker(concurrency=2), 0.2)
+
+    asyncio.run(scenario())
+    assert len(reaped) >= 2
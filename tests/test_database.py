@@ -0,0 +1,206 @@
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+try:
+    import psycopg2
+
+    from services import database
+    from services.database import RECOMMEND_LIMIT, _merge_job_recommendation, get_connection
+except ImportError as e:
+    pytest.skip(f"Service dependencies unavailable: {e}", allow_module_level=True)
+
+
+def entries(*scores):
+    return [{"cv_id": cv_id, "score": score, "explanation": f"cv {cv_id}"} for cv_id, score in enumerate(scores)]
+
+
+def test_new_match_is_inserted_in_score_order():
+    merged = _merge_job_recommendation(entries(0.9, 0.7), 5, 0.8, "new")
+    assert [(entry["cv_id"], entry["score"]) for entry in merged] == [(0, 0.9), (5, 0.8), (1, 0.7)]
+
+
+def test_new_match_below_a_full_list_is_left_out():
+    cached = entries(*[0.9 - i * 0.01 for i in range(RECOMMEND_LIMIT)])
+    merged = _merge_job_recommendation(cached, 99, 0.5, "low")
+    assert merged == cached
+
+
+def test_new_match_pushes_the_weakest_entry_out_of_a_full_list():
+    cached = entries(*[0.9 - i * 0.01 for i in range(RECOMMEND_LIMIT)])
+    merged = _merge_job_recommendation(cached, 99, 0.95, "top")
+    assert len(merged) == RECOMMEND_LIMIT
+    assert merged[0]["cv_id"] == 99
+    assert RECOMMEND_LIMIT - 1 not in [entry["cv_id"] for entry in merged]
+
+
+def test_existing_match_is_rescored_in_place():
+    merged = _merge_job_recommendation(entries(0.9, 0.7, 0.6), 2, 0.95, "better")
+    assert [entry["cv_id"] for entry in merged] == [2, 0, 1]
+    assert merged[0] == {"cv_id": 2, "score": 0.95, "explanation": "better"}
+
+
+def test_full_list_is_dropped_when_an_entry_falls_below_every_cached_score():
+    cached = entries(*[0.9 - i * 0.01 for i in range(RECOMMEND_LIMIT)])
+    assert _merge_job_recommendation(cached, 0, 0.55, "worse") is None
+
+
+def test_short_list_keeps_a_lowered_entry():
+    merged = _merge_job_recommendation(entries(0.9, 0.7), 0, 0.6, "worse")
+    assert [(entry["cv_id"], entry["score"]) for entry in merged] == [(1, 0.7), (0, 0.6)]
+
+
+def test_deleted_match_is_removed_from_a_short_list():
+    merged = _merge_job_recommendation(entries(0.9, 0.7, 0.6), 1, None, None)
+    assert [entry["cv_id"] for entry in merged] == [0, 2]
+
+
+def test_deleted_match_drops_a_full_list():
+    cached = entries(*[0.9 - i * 0.01 for i in range(RECOMMEND_LIMIT)])
+    assert _merge_job_recommendation(cached, 3, None, None) is None
+
+
+def test_deleted_match_not_in_the_list_changes_nothing():
+    cached = entries(0.9, 0.7)
+    assert _merge_job_recommendation(cached, 42, None, None) == cached
+
+
+# === Connection pool ===
+class FakeConnection:
+    def __init__(self, closed: bool = False):
+        self.closed = closed
+
+
+class FakePool:
+    """
+    Hands out ``connections`` in order; an exception in the list is raised by getconn
+    """
+
+    def __init__(self, *connections):
+        self.connections = list(connections)
+        self.returned = []
+
+    def getconn(self):
+        item = self.connections.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def putconn(self, conn, close=False):
+        if any(conn is returned for returned, _ in self.returned):
+            raise psycopg2.pool.PoolError("trying to put unkeyed connection")
+        self.returned.append((conn, close))
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    def install(*connections):
+        fake = FakePool(*connections)
+        monkeypatch.setattr(database, "_pool", fake)
+        monkeypatch.setattr(database, "_pool_slots", threading.BoundedSemaphore(1))
+        return fake
+    return install
+
+
+def test_connection_is_returned_and_slot_released(pool):
+    conn = FakeConnection()
+    fake = pool(conn)
+    database._pool_last_used[id(conn)] = float("inf")  # recently used, no health check
+
+    with get_connection() as borrowed:
+        assert borrowed is conn
+    assert fake.returned == [(conn, False)]
+    assert database._pool_slots.acquire(blocking=False)
+
+
+def test_failed_replacement_of_an_unhealthy_connection(pool):
+    dead = FakeConnection(closed=True)
+    fake = pool(dead, psycopg2.OperationalError("the database system is starting up"))
+
+    with pytest.raises(psycopg2.OperationalError):
+        with get_connection():
+            pass
+    assert fake.returned == [(dead, True)]
+    assert database._pool_slots.acquire(blocking=False)
+
+
+def test_slot_is_released_when_the_pool_cannot_be_created(monkeypatch):
+    def unreachable():
+        raise psycopg2.OperationalError("could not connect to server")
+
+    monkeypatch.setattr(database, "_pool_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(database, "get_pool", unreachable)
+
+    with pytest.raises(psycopg2.OperationalError):
+        with get_connection():
+            pass
+    assert database._pool_slots.acquire(blocking=False)
+
+
+# === Versioned recommendation writes ===
+class RecordingCursor:
+    def __init__(self, log, rows):
+        self.log, self.rows = log, rows
+
+    def execute(self, query, params):
+        self.log.append("query")
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def recommend_cv(monkeypatch):
+    """
+    recommend_jobs_for_cv(s) against a fake connection, logging cache and query calls in order
+    """
+    log, stored = [], {}
+    rows = []
+
+    @contextmanager
+    def connection():
+        yield SimpleNamespace(cursor=lambda: RecordingCursor(log, rows))
+
+    def cache_version(family, cv_id):
+        log.append("version")
+        return "4"
+
+    def cache_versions(family, cv_ids):
+        log.append("versions")
+        return {cv_id: "4" for cv_id in cv_ids}
+
+    def cache_set_if_version(family, value, version, cv_id):
+        stored[cv_id] = (value, version)
+
+    def cache_set_many_if_version(family, values, versions):
+        stored.update({cv_id: (value, versions[cv_id]) for cv_id, value in values.items()})
+
+    monkeypatch.setattr(database, "get_connection", connection)
+    monkeypatch.setattr(database, "cache_get", lambda family, cv_id: None)
+    monkeypatch.setattr(database, "cache_mget", lambda family, cv_ids: dict.fromkeys(cv_ids))
+    monkeypatch.setattr(database, "cache_version", cache_version)
+    monkeypatch.setattr(database, "cache_versions", cache_versions)
+    monkeypatch.setattr(database, "cache_set_if_version", cache_set_if_version)
+    monkeypatch.setattr(database, "cache_set_many_if_version", cache_set_many_if_version)
+    return SimpleNamespace(log=log, stored=stored, rows=rows)
+
+
+def test_single_cv_recommendations_are_stored_against_the_version_seen_before_the_query(recommend_cv):
+    recommend_cv.rows.append((3, 0.9, "fits"))
+    database.recommend_jobs_for_cv(7)
+
+    assert recommend_cv.log == ["version", "query"]
+    assert recommend_cv.stored == {7: ([{"job_id": 3, "score": 0.9, "explanation": "fits"}], "4")}
+
+
+def test_batch_recommendations_are_stored_against_the_versions_seen_before_the_query(recommend_cv):
+    recommend_cv.rows.append((7, 3, 0.9, "fits"))
+    database.recommend_jobs_for_cvs([7, 8])
+
+    assert recommend_cv.log == ["versions", "query"]
+    assert recommend_cv.stored == {7: ([{"job_id": 3, "score": 0.9, "explanation": "fits"}], "4"), 8: ([], "4")}
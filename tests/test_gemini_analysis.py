@@ -0,0 +1,169 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+# WeasyPrint raises OSError, not ImportError, when its system libraries are missing
+try:
+    from services import gemini_analysis
+    from services.gemini_analysis import (
+        FILTER_BATCH_PROMPT, FilterRequest, pack_filter_batches, parse_json_array_response
+    )
+    from services.llm_client import LLMDeadlineExceeded
+except (ImportError, OSError) as e:
+    pytest.skip(f"Service dependencies unavailable: {e}", allow_module_level=True)
+
+
+# === parse_json_array_response ===
+def reply(content: str):
+    return SimpleNamespace(content=content)
+
+
+def test_parses_a_json_array():
+    items = parse_json_array_response(reply(
+        '[{"job_id": 1, "score": 0.8, "explanation": "good"}, {"job_id": 2, "score": 0.1, "explanation": "no"}]'
+    ))
+    assert [item["job_id"] for item in items] == [1, 2]
+
+
+def test_parses_a_fenced_array_with_surrounding_text():
+    items = parse_json_array_response(reply('```json\nHere you go:\n[{"job_id": 3, "score": 0.5}]\n```'))
+    assert items == [{"job_id": 3, "score": 0.5}]
+
+
+def test_drops_items_that_are_not_objects():
+    items = parse_json_array_response(reply('[{"job_id": 1, "score": 0.9}, "oops", 4, null]'))
+    assert items == [{"job_id": 1, "score": 0.9}]
+
+
+def test_salvages_objects_from_a_broken_array():
+    items = parse_json_array_response(reply(
+        '[{"job_id": 1, "score": 0.7, "explanation": "ok"}, {"job_id": 2, "score": 0.4, "explanation": "cut of'
+    ))
+    assert items == [{"job_id": 1, "score": 0.7, "explanation": "ok"}]
+
+
+def test_accepts_plain_strings():
+    assert parse_json_array_response('[{"job_id": 9}]') == [{"job_id": 9}]
+
+
+@pytest.mark.parametrize("content", ["", "   ", "no json here", "[1, 2, 3"])
+def test_rejects_replies_without_objects(content):
+    with pytest.raises(ValueError):
+        parse_json_array_response(reply(content))
+
+
+# === pack_filter_batches ===
+@pytest.fixture
+def word_tokens(monkeypatch):
+    """
+    One token per word, so batch sizes are easy to reason about
+    """
+    monkeypatch.setattr(gemini_analysis, "count_tokens", lambda text: len(text.split()))
+    overhead = len(FILTER_BATCH_PROMPT.template.split()) + len("{}".split())
+    return overhead
+
+
+def cv_rows(words_per_cv: list):
+    return [(f"hash{i}", " ".join(["skill"] * words), [i]) for i, words in enumerate(words_per_cv)]
+
+
+def test_batches_stay_within_the_token_budget(word_tokens):
+    # Each CV costs 84 words + 16 for its header: two fit in 250 available tokens, three do not
+    rows = cv_rows([84] * 5)
+    batches = pack_filter_batches(rows, "{}", budget=word_tokens + 250, max_cvs=10)
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_batches_are_capped_at_max_cvs(word_tokens):
+    rows = cv_rows([4] * 7)
+    batches = pack_filter_batches(rows, "{}", budget=word_tokens + 10_000, max_cvs=3)
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+
+
+def test_an_oversized_cv_gets_a_batch_of_its_own(word_tokens):
+    rows = cv_rows([10, 5000, 10])
+    batches = pack_filter_batches(rows, "{}", budget=word_tokens + 100, max_cvs=10)
+    assert [[row[0] for row in batch] for batch in batches] == [["hash0"], ["hash1"], ["hash2"]]
+
+
+def test_every_row_is_packed_once_in_order(word_tokens):
+    rows = cv_rows([30, 70, 10, 90, 20, 40])
+    batches = pack_filter_batches(rows, "{}", budget=word_tokens + 150, max_cvs=4)
+    assert [row for batch in batches for row in batch] == rows
+
+
+def test_no_rows_no_batches(word_tokens):
+    assert pack_filter_batches([], "{}", budget=1000) == []
+
+
+# === filter_candidates (batched) ===
+@pytest.fixture
+def filter_rows(monkeypatch, word_tokens):
+    """
+    Three CVs; Gemini replies come from ``replies``, keyed by prompt name
+    """
+    rows = [(f"hash{i}", f"cv text {i}", [i]) for i in (1, 2, 3)]
+    replies, calls = {}, []
+
+    async def canonicalize(texts, budget):
+        return texts
+
+    async def ainvoke(name, prompt, model, inputs, parser, deadline=None, stats=None):
+        calls.append(name)
+        reply = replies[name]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply(inputs) if callable(reply) else reply
+
+    monkeypatch.setattr(gemini_analysis, "get_cv_for_filter", lambda: rows)
+    monkeypatch.setattr(gemini_analysis, "canonicalize_many", canonicalize)
+    monkeypatch.setattr(gemini_analysis.llm_cache, "ainvoke", ainvoke)
+    return replies, calls
+
+
+def run_filter():
+    return asyncio.run(gemini_analysis.filter_candidates(FilterRequest(filters={"skill": "Python"}, batched=True)))
+
+
+def test_out_of_range_batch_scores_are_rescored_one_by_one(filter_rows):
+    replies, calls = filter_rows
+    replies["candidate_filter_batch"] = [
+        {"cv_id": 1, "match_score": 0.9, "reason": "fits"},
+        {"cv_id": 2, "match_score": 7, "reason": "scale confusion"},
+        {"cv_id": 3, "match_score": 0.1, "reason": "no"},
+    ]
+    replies["candidate_filter"] = {"match_score": 0.7, "reason": "rescored"}
+
+    result = run_filter()
+    assert calls == ["candidate_filter_batch", "candidate_filter"]
+    assert [(m["cv_id"], m["match_score"]) for m in result["matched_candidates"]] == [(1, 0.9), (2, 0.7)]
+
+
+def test_rate_limited_batch_is_not_rescored(filter_rows):
+    replies, calls = filter_rows
+    replies["candidate_filter_batch"] = RuntimeError("429 Resource has been exhausted")
+
+    result = run_filter()
+    assert calls == ["candidate_filter_batch"]
+    assert result["matched_candidates"] == []
+    assert result["failed"] == 3
+
+
+def test_batch_past_its_deadline_is_dropped_once_per_cv(filter_rows):
+    replies, calls = filter_rows
+    replies["candidate_filter_batch"] = LLMDeadlineExceeded("deadline passed")
+
+    result = run_filter()
+    assert calls == ["candidate_filter_batch"]
+    assert result["dropped"] == 3 and result["failed"] == 0
+
+
+def test_other_batch_failures_fall_back_to_single_calls(filter_rows):
+    replies, calls = filter_rows
+    replies["candidate_filter_batch"] = ValueError("Reply contains no JSON array")
+    replies["candidate_filter"] = {"match_score": 0.8, "reason": "fits"}
+
+    result = run_filter()
+    assert calls.count("candidate_filter") == 3
+    assert sorted(m["cv_id"] for m in result["matched_candidates"]) == [1, 2, 3]
@@ -0,0 +1,196 @@
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+try:
+    from services import job_neighbors as neighbors_module
+    from services.job_neighbors import JobNeighborTable
+except ImportError as e:
+    pytest.skip(f"Service dependencies unavailable: {e}", allow_module_level=True)
+
+
+DIM = 16
+WIDTH = 5
+
+
+class FakeJobIndex:
+    """
+    Active jobs with unit vectors; editing a job changes its detail hash like a real re-embed
+    """
+
+    def __init__(self, count: int, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+        self.jobs = {}
+        for job_id in range(1, count + 1):
+            self.put(job_id)
+
+    def put(self, job_id: int):
+        vector = self.rng.normal(size=DIM).astype(np.float32)
+        revision = self.jobs[job_id][0] + 1 if job_id in self.jobs else 0
+        self.jobs[job_id] = (revision, vector / np.linalg.norm(vector))
+
+    def remove(self, job_id: int):
+        del self.jobs[job_id]
+
+    def refresh(self):
+        return {}
+
+    def active(self):
+        ids = np.array(sorted(self.jobs), dtype=np.int64)
+        hashes = np.array([f"{job_id}-{self.jobs[job_id][0]}" for job_id in ids], dtype="U64")
+        vectors = np.stack([self.jobs[job_id][1] for job_id in ids]) if ids.size else np.empty((0, DIM), np.float32)
+        return ids, hashes, vectors
+
+    def is_active(self, job_ids):
+        return np.array([int(job_id) in self.jobs for job_id in job_ids], dtype=bool)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = FakeJobIndex(40)
+    invalidated = []
+    monkeypatch.setattr(neighbors_module, "job_index", index)
+    monkeypatch.setattr(neighbors_module, "invalidate_related_jobs", invalidated.extend)
+    index.invalidated = invalidated
+    return index
+
+
+def rows(table: JobNeighborTable):
+    """
+    {job id: (neighbour ids, neighbour scores)} of the table's current snapshot
+    """
+    snapshot = table._snapshot
+    return {
+        int(job_id): (snapshot.neighbor_ids[pos], snapshot.neighbor_scores[pos])
+        for job_id, pos in snapshot.positions.items()
+    }
+
+
+def brute_force_neighbors(index: FakeJobIndex, job_id: int):
+    ids, _, vectors = index.active()
+    scores = vectors @ index.jobs[job_id][1]
+    order = [i for i in np.argsort(-scores, kind="stable") if ids[i] != job_id][:WIDTH]
+    return ids[order], scores[order]
+
+
+def assert_same_table(table: JobNeighborTable, expected: JobNeighborTable):
+    actual, wanted = rows(table), rows(expected)
+    assert actual.keys() == wanted.keys()
+    for job_id in wanted:
+        np.testing.assert_array_equal(actual[job_id][0], wanted[job_id][0])
+        np.testing.assert_allclose(actual[job_id][1], wanted[job_id][1], rtol=1e-5)
+
+
+def test_full_build_matches_brute_force(index, tmp_path):
+    table = JobNeighborTable(path=str(tmp_path / "neighbors.npz"), width=WIDTH)
+    stats = table.build()
+
+    assert stats == {"jobs": 40, "recomputed_rows": 40}
+    for job_id, (neighbor_ids, scores) in rows(table).items():
+        expected_ids, expected_scores = brute_force_neighbors(index, job_id)
+        np.testing.assert_array_equal(neighbor_ids, expected_ids)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+def test_sync_without_changes_recomputes_nothing(index, tmp_path):
+    table = JobNeighborTable(path=str(tmp_path / "neighbors.npz"), width=WIDTH)
+    table.build()
+    index.invalidated.clear()
+
+    assert table.sync() == {"jobs": 40, "recomputed_rows": 0}
+    assert index.invalidated == []
+
+
+def test_incremental_sync_matches_a_full_rebuild(index, tmp_path):
+    table = JobNeighborTable(path=str(tmp_path / "neighbors.npz"), width=WIDTH)
+    table.build()
+
+    index.put(3)  # edited
+    index.put(17)
+    index.remove(8)  # expired
+    index.put(41)  # added
+    index.put(42)
+    index.invalidated.clear()
+    stats = table.sync()
+
+    rebuilt = JobNeighborTable(path=str(tmp_path / "rebuilt.npz"), width=WIDTH)
+    rebuilt.build()
+    assert_same_table(table, rebuilt)
+    assert stats["jobs"] == 41
+    assert 4 <= stats["recomputed_rows"] < 41
+    assert {3, 17, 41, 42, 8} <= set(index.invalidated)
+
+
+def test_synced_table_is_reloaded_by_another_instance(index, tmp_path):
+    path = str(tmp_path / "neighbors.npz")
+    table = JobNeighborTable(path=path, width=WIDTH)
+    table.build()
+
+    other = JobNeighborTable(path=path, width=WIDTH)
+    assert other.load()
+    assert_same_table(other, table)
+
+
+def test_lookup_filters_by_similarity_and_limit(index, tmp_path):
+    table = JobNeighborTable(path=str(tmp_path / "neighbors.npz"), width=WIDTH)
+    table.build()
+    neighbor_ids, scores = rows(table)[5]
+
+    assert table.lookup(5) == [(int(i), float(s)) for i, s in zip(neighbor_ids, scores) if s >= 0.3]
+    assert table.lookup(5, limit=2, min_similarity=-1.0) == [
+        (int(i), float(s)) for i, s in zip(neighbor_ids[:2], scores[:2])
+    ]
+
+
+def test_lookup_leaves_out_neighbours_expired_since_the_last_sync(index, tmp_path):
+    table = JobNeighborTable(path=str(tmp_path / "neighbors.npz"), width=WIDTH)
+    table.build()
+    neighbor_ids, _ = rows(table)[5]
+    expired = int(neighbor_ids[0])
+    index.remove(expired)
+
+    neighbors = table.lookup(5, min_similarity=-1.0)
+    assert [job_id for job_id, _ in neighbors] == [int(i) for i in neighbor_ids if i != expired]
+
+
+def test_background_sync_repeats(index, tmp_path, monkeypatch):
+    table = JobNeighborTable(path=str(tmp_path / "neighbors.npz"), width=WIDTH)
+    calls = []
+    synced = threading.Event()
+
+    def sync(full=False):
+        calls.append(full)
+        if len(calls) == 2:
+            synced.set()
+            threading.Event().wait()  # park the daemon thread for good
+
+    monkeypatch.setattr(table, "sync", sync)
+    table.sync_in_background(interval=0.01)
+    assert synced.wait(timeout=5)
+
+
+def test_lookup_embeds_jobs_missing_from_the_table(index, tmp_path, monkeypatch):
+    table = JobNeighborTable(path=str(tmp_path / "neighbors.npz"), width=WIDTH)
+    table.build()
+    expired_vector = index.jobs[8][1]
+    index.remove(8)
+    table.sync()
+    assert 8 not in table._snapshot.positions
+
+    monkeypatch.setattr(neighbors_module, "embed_texts", lambda texts: np.stack([expired_vector]))
+    monkeypatch.setattr(table, "sync", lambda full=False: pytest.fail("lookup must not sync"))
+    neighbors = table.lookup(8, "expired posting", min_similarity=-1.0)
+
+    ids, _, vectors = index.active()
+    scores = vectors @ expired_vector
+    order = np.argsort(-scores, kind="stable")[:WIDTH]
+    assert [job_id for job_id, _ in neighbors] == ids[order].tolist()
+    np.testing.assert_allclose([score for _, score in neighbors], scores[order], rtol=1e-5)
+
+
+def test_lookup_without_a_detail_for_an_unknown_job_is_empty(index, tmp_path):
+    table = JobNeighborTable(path=str(tmp_path / "neighbors.npz"), width=WIDTH)
+    table.build()
+    assert table.lookup(999) == []
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+
+try:
+    from services import llm_client
+    from services.llm_client import LLMDeadlineExceeded, RedisTokenBucket, TokenBucket, get_bucket
+except ImportError as e:
+    pytest.skip(f"Service dependencies unavailable: {e}", allow_module_level=True)
+
+
+def test_tokens_are_taken_until_the_bucket_is_empty():
+    async def scenario():
+        bucket = TokenBucket(60)
+        await bucket.acquire(60, time.monotonic() + 1)
+        with pytest.raises(LLMDeadlineExceeded):
+            await bucket.acquire(10, time.monotonic() + 1)  # refills at one token per second
+        return await bucket.stats()
+
+    assert asyncio.run(scenario())["available"] < 1
+
+
+def test_adjust_settles_usage_above_the_estimate():
+    async def scenario():
+        bucket = TokenBucket(6000)
+        await bucket.acquire(100, time.monotonic() + 1)
+        await bucket.adjust(400)
+        return await bucket.stats()
+
+    assert asyncio.run(scenario())["available"] == pytest.approx(5500, abs=5)
+
+
+def test_shared_bucket_waits_as_long_as_redis_says(monkeypatch):
+    calls = []
+
+    async def take_tokens(keys, args):
+        calls.append((keys, args))
+        return ("0.05", "0") if len(calls) == 1 else ("0", "0")
+
+    monkeypatch.setattr(llm_client, "_take_tokens", take_tokens)
+
+    async def scenario():
+        started = time.monotonic()
+        await RedisTokenBucket("gemini_rate:requests", 60).acquire(1, started + 1)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.05
+    assert calls == [(["gemini_rate:requests"], [60, 1.0, 1, "0"])] * 2
+
+
+def test_shared_bucket_gives_up_past_the_deadline(monkeypatch):
+    async def take_tokens(keys, args):
+        return "30", "0"
+
+    monkeypatch.setattr(llm_client, "_take_tokens", take_tokens)
+    with pytest.raises(LLMDeadlineExceeded):
+        asyncio.run(RedisTokenBucket("gemini_rate:tokens", 60).acquire(1, time.monotonic() + 1))
+
+
+def test_bucket_backends():
+    assert get_bucket("requests", 0) is None
+    assert type(get_bucket("requests", 60, "local")) is TokenBucket
+    assert get_bucket("requests", 60, "redis").key == "gemini_rate:requests"
+    with pytest.raises(ValueError):
+        get_bucket("requests", 60, "memcached")
@@ -0,0 +1,65 @@
+import pytest
+
+for module in ("dotenv", "cachetools", "redis", "orjson", "zstandard"):
+    pytest.importorskip(module)
+
+from services.preprocess import TRUNCATION_MARKER, fit_to_budget, is_html, normalize_text
+from services.tokens import count_tokens, get_encoding
+
+
+# === normalize_text ===
+def test_html_is_stripped_and_unescaped():
+    text = "<div><h2>Skills</h2><ul><li>Python &amp; SQL</li><li>Docker</li></ul></div>"
+    assert normalize_text(text) == "Skills\n\nPython & SQL\n\nDocker"
+
+
+def test_angle_brackets_in_plain_text_are_kept():
+    text = "Requirements:\n<3 years in Go>\n<Senior> backend role"
+    assert not is_html(text)
+    assert normalize_text(text) == text
+
+
+def test_only_consecutive_duplicate_lines_are_dropped():
+    text = "Experience\nPython\nPython\npython\nEducation\nPython"
+    assert normalize_text(text) == "Experience\nPython\nEducation\nPython"
+
+
+def test_boilerplate_lines_are_dropped():
+    text = "Curriculum Vitae\nJane Doe\nPage 1 of 2\nBackend engineer\nReferences available upon request."
+    assert normalize_text(text) == "Jane Doe\nBackend engineer"
+
+
+def test_whitespace_is_collapsed():
+    text = "  Python \t  developer  \n\n\n\n\nRemote work "
+    assert normalize_text(text) == "Python developer\n\nRemote work"
+
+
+def test_empty_text():
+    assert normalize_text(None) == ""
+    assert normalize_text("   \n ") == ""
+
+
+# === fit_to_budget ===
+@pytest.fixture
+def encoding():
+    pytest.importorskip("tiktoken")
+    try:
+        get_encoding()
+    except Exception as e:  # the encoding file is downloaded on first use
+        pytest.skip(f"Tokenizer unavailable: {e}")
+
+
+def test_text_within_budget_is_unchanged(encoding):
+    text = "Python developer with five years of experience."
+    assert fit_to_budget(text, 100) == text
+    assert fit_to_budget(text, 0) == text
+
+
+def test_long_text_keeps_start_and_end(encoding):
+    text = " ".join(f"word{i}" for i in range(2000))
+    fitted = fit_to_budget(text, 200)
+
+    assert count_tokens(fitted) <= 200 + count_tokens(TRUNCATION_MARKER)
+    assert fitted.startswith("word0 word1")
+    assert fitted.endswith("word1999")
+    assert TRUNCATION_MARKER in fitted
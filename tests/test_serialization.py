@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("orjson")
+pytest.importorskip("zstandard")
+
+from services.serialization import (
+    CODEC_ORJSON, CODEC_ORJSON_ZSTD, HEADER_MAGIC, CompactSerializer, JsonSerializer, decode
+)
+
+ANALYSIS = {
+    "cv_id": 42,
+    "matches": [
+        {"job_id": job_id, "match_score": 0.5 + job_id / 100, "explanation": "Solid Python and SQL background. " * 4}
+        for job_id in range(30)
+    ]
+}
+
+
+def test_small_values_are_not_compressed():
+    raw = CompactSerializer(min_bytes=1024).dumps({"cv_id": 1})
+    assert raw[:2] == bytes((HEADER_MAGIC, CODEC_ORJSON))
+    assert CompactSerializer().loads(raw) == {"cv_id": 1}
+
+
+def test_large_values_round_trip_compressed():
+    serializer = CompactSerializer(min_bytes=1024)
+    raw = serializer.dumps(ANALYSIS)
+    assert raw[:2] == bytes((HEADER_MAGIC, CODEC_ORJSON_ZSTD))
+    assert len(raw) < len(JsonSerializer().dumps(ANALYSIS))
+    assert serializer.loads(raw) == ANALYSIS
+
+
+def test_unicode_round_trip():
+    value = {"explanation": "Kinh nghiệm 3 năm với Go — 日本語"}
+    assert CompactSerializer(min_bytes=0).loads(CompactSerializer(min_bytes=0).dumps(value)) == value
+
+
+def test_headerless_values_are_read_as_json():
+    assert CompactSerializer().loads(b'{"cv_id": 7, "matches": []}') == {"cv_id": 7, "matches": []}
+    assert decode('[1, 2, 3]') == [1, 2, 3]
+
+
+@pytest.mark.parametrize("min_bytes", [0, 1 << 20])
+def test_json_serializer_reads_compact_values(min_bytes):
+    raw = CompactSerializer(min_bytes=min_bytes).dumps(ANALYSIS)
+    assert JsonSerializer().loads(raw) == ANALYSIS
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        decode(bytes((HEADER_MAGIC, 0x7F)) + b"{}")